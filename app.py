@@ -1,4 +1,10 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, render_template, request, jsonify, g
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+import json
+import threading
+import time
 import sys
 import os
 
@@ -6,14 +12,163 @@ import os
 # User will need to copy this file to their project directory
 # or update this path to point to their basic.py location
 try:
-    from basic import run
+    from basic import (run_recovering, parse_lexed, relex, IterativeParser, FastLexer, IllegalCharError,
+                       TOKEN_TYPES, Budget, BudgetExceeded)
+    from mapped_lexer import lex_file, detach, FileLexer
+    from token_formats import serialize_tokens, compact_result
+    from token_stats import TokenStats, TOP_IDENTIFIERS
+    from live import LiveChannel
+    from result_cache import ResultCache, source_key
+    from evaluator import compile_source, is_value
+    import metrics
 except ImportError:
     # If basic.py is not in the same directory, try to import from parent
     sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
-    from basic import run
+    from basic import (run_recovering, parse_lexed, relex, IterativeParser, FastLexer, IllegalCharError,
+                       TOKEN_TYPES, Budget, BudgetExceeded)
+    from mapped_lexer import lex_file, detach, FileLexer
+    from token_formats import serialize_tokens, compact_result
+    from token_stats import TokenStats, TOP_IDENTIFIERS
+    from live import LiveChannel
+    from result_cache import ResultCache, source_key
+    from evaluator import compile_source, is_value
+    import metrics
 
 app = Flask(__name__)
 
+# Response formats of /execute and /execute_file, picked with ?format= or the
+# Accept header: the default JSON, the same JSON streamed in chunks, or a
+# columnar form with type ids and source offsets instead of per-token strings
+COMPACT_MIMETYPE = 'application/vnd.lexer.compact+json'
+STREAM_MIMETYPE = 'application/vnd.lexer.stream+json'
+RESPONSE_FORMATS = {
+    'application/json': 'json',
+    COMPACT_MIMETYPE: 'compact',
+    STREAM_MIMETYPE: 'stream'
+}
+STREAM_CHUNK_TOKENS = 8192
+
+# Results of process_code keyed by a hash of the source, and /execute_file
+# results keyed by path and validated against the file's mtime and size
+result_cache = ResultCache(max_entries=512, max_bytes=64 * 1024 * 1024)
+file_cache = ResultCache(max_entries=64, max_bytes=64 * 1024 * 1024)
+# Compiled /evaluate programs keyed by a hash of the source, so running the
+# same source again skips lexing, parsing and compiling
+program_cache = ResultCache(max_entries=512, max_bytes=16 * 1024 * 1024)
+
+# /execute_file serves the files under this directory (files/ next to this
+# module unless LEXER_FILES_DIR says otherwise), test.txt when no path is
+# given. Hidden files and directories are never served.
+FILES_DIR = os.path.realpath(os.environ.get('LEXER_FILES_DIR') or
+                             os.path.join(os.path.dirname(os.path.abspath(__file__)), 'files'))
+DEFAULT_FILE = 'test.txt'
+
+# Most lexer diagnostics reported in one response
+MAX_DIAGNOSTICS = 100
+
+def env_limit(name, default, kind=int):
+    """A limit from the environment, where 0 means no limit (None)"""
+    value = os.environ.get(name)
+    return (kind(value) or None) if value else default
+
+# Limits on each posted source (see basic.Budget), so one huge or
+# pathological input cannot hold a worker for long; each can be overridden
+# in the environment. Larger request bodies are refused before being read.
+MAX_SOURCE_BYTES = env_limit('LEXER_MAX_SOURCE_BYTES', 4 * 1024 * 1024)
+MAX_TOKENS = env_limit('LEXER_MAX_TOKENS', 1000000)
+MAX_DEPTH = env_limit('LEXER_MAX_DEPTH', 10000)
+TIME_BUDGET = env_limit('LEXER_TIME_BUDGET', 3.0, float)  # seconds
+MAX_REQUEST_BYTES = env_limit('LEXER_MAX_REQUEST_BYTES', 8 * 1024 * 1024)
+app.config['MAX_CONTENT_LENGTH'] = MAX_REQUEST_BYTES
+
+# /execute_batch limits and the worker pool it fans out to
+MAX_BATCH_SIZE = 1000
+BATCH_ITEM_TIMEOUT = 5.0  # seconds
+BATCH_WORKERS = os.cpu_count() or 1
+batch_pool = None
+batch_pool_lock = threading.Lock()
+
+# Last token stream per editor document, for incremental re-lexing and for
+# paging through its tokens, bounded by count and by document_size total
+MAX_DOCUMENTS = 256
+MAX_DOCUMENT_BYTES = 64 * 1024 * 1024
+documents = OrderedDict()  # doc id -> (tokens, relexable, size)
+documents_bytes = 0
+documents_lock = threading.Lock()
+
+# Token lists sent per page when a client asks for them a page at a time
+TOKEN_PAGE_SIZE = 1000
+MAX_TOKEN_PAGE = 10000
+
+def remember_document(doc_id, tokens, relexable=True):
+    """Keep tokens for doc_id; only a relexable stream (lexed without errors) is used for deltas"""
+    global documents_bytes
+    size = document_size(tokens)
+    with documents_lock:
+        old = documents.pop(doc_id, None)
+        if old is not None:
+            documents_bytes -= old[2]
+        if size > MAX_DOCUMENT_BYTES:
+            return
+        documents[doc_id] = (tokens, relexable, size)
+        documents_bytes += size
+        while len(documents) > MAX_DOCUMENTS or documents_bytes > MAX_DOCUMENT_BYTES:
+            documents_bytes -= documents.popitem(last=False)[1][2]
+
+def recall_document(doc_id, relexable=True):
+    with documents_lock:
+        entry = documents.get(doc_id)
+        if entry is None or (relexable and not entry[1]):
+            return None
+        documents.move_to_end(doc_id)
+        return entry[0]
+
+def forget_document(doc_id):
+    global documents_bytes
+    with documents_lock:
+        old = documents.pop(doc_id, None)
+        if old is not None:
+            documents_bytes -= old[2]
+
+def live_result(doc_id, code, cancelled, page=None):
+    """The /execute JSON result for a live revision, abandoned once cancelled() is true"""
+    timings = {} if metrics.enabled else None
+    response_data, tokens = code_result(code, doc_id, timings, cancelled)
+    return token_lists(response_data, tokens, page, timings)
+
+live_channel = LiveChannel(live_result)
+
+@app.before_request
+def start_timer():
+    if metrics.enabled:
+        g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request(response):
+    if metrics.enabled and 'request_start' in g:
+        metrics.observe_request(request.endpoint or 'unknown', response.status_code,
+                                time.perf_counter() - g.request_start)
+    return response
+
+@app.errorhandler(413)
+def request_too_large(e):
+    metrics.observe_budget('bytes')
+    return jsonify({
+        'success': False,
+        'error': f'Request body too large, the limit is {MAX_REQUEST_BYTES} bytes',
+        'budget': 'bytes'
+    }), 413
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus text-format metrics"""
+    cache_values = {}
+    for cache_name, cache in (('results', result_cache), ('files', file_cache), ('programs', program_cache)):
+        for stat, value in cache.stats().items():
+            cache_values[(('cache', cache_name), ('stat', stat))] = value
+    extra = metrics.gauge_lines('lexer_cache', 'Result cache statistics', cache_values)
+    return app.response_class(metrics.render(extra), mimetype='text/plain; version=0.0.4')
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -22,80 +177,490 @@ def index():
 def execute():
     data = request.get_json()
     code = data.get('code', '')
-    return process_code(code)
+    want_timings = bool(data.get('timings') or request.args.get('timings'))
+    fmt = response_format()
+    if fmt is None:
+        return unknown_format()
+    doc_id = data.get('doc')
+    if not valid_doc(doc_id):
+        return bad_doc()
+    return process_code(code, doc_id, want_timings, fmt, page_size(data.get('page')))
+
+@app.route('/evaluate', methods=['POST'])
+def evaluate():
+    """Evaluate an expression, with values for its variables, from a cached compiled program"""
+    data = request.get_json(silent=True) or {}
+    code = data.get('code')
+    variables = data.get('variables', {})
+    if (not isinstance(code, str) or not isinstance(variables, dict)
+            or not all(is_value(value) for value in variables.values())):
+        return jsonify({
+            'success': False,
+            'error': 'Expected a JSON object with a "code" string and an optional "variables" '
+                     'object of numbers and lists'
+        }), 400
+    if not code.strip():
+        return jsonify({
+            'success': False,
+            'error': 'Please enter some code to execute'
+        })
+    
+    timings = {}
+    budget = request_budget()
+    try:
+        # Checked before the source is even hashed
+        budget.check_source('<web>', code)
+    except BudgetExceeded as e:
+        return budget_response(e.error)
+    key = source_key(code)
+    cached = program_cache.get(key)
+    if cached is None:
+        start = time.perf_counter()
+        try:
+            program, error = compile_source('<web>', code, budget)
+        except BudgetExceeded as e:
+            return budget_response(e.error)
+        timings['compile_ms'] = (time.perf_counter() - start) * 1000
+        # Sources that do not compile are cached too, with their error
+        cached = (program, error.as_string() if error else None)
+        program_cache.put(key, cached, program_size(code, program))
+        timings['cache'] = 'miss'
+    else:
+        timings['cache'] = 'hit'
+    
+    program, error = cached
+    if program is None:
+        return jsonify({'success': False, 'error': error})
+    start = time.perf_counter()
+    try:
+        value, error = program.run(variables, budget)
+    except BudgetExceeded as e:
+        return budget_response(e.error)
+    timings['eval_ms'] = (time.perf_counter() - start) * 1000
+    if error:
+        response_data = {'success': False, 'error': error.as_string()}
+    else:
+        response_data = {'success': True, 'value': value}
+    if data.get('timings') or request.args.get('timings'):
+        response_data['timings'] = timings
+    return jsonify(response_data)
+
+@app.route('/execute_delta', methods=['POST'])
+def execute_delta():
+    """Re-lex only the part of a known document touched by an edit"""
+    data = request.get_json()
+    doc_id = data.get('doc')
+    offset = data.get('offset')
+    deleted = data.get('deleted')
+    inserted = data.get('inserted', '')
+    if not valid_doc(doc_id):
+        return bad_doc()
+    
+    old = recall_document(doc_id) if doc_id else None
+    if (old is None or not isinstance(offset, int) or not isinstance(deleted, int)
+            or not isinstance(inserted, str) or offset < 0 or deleted < 0
+            or offset + deleted > len(old.text)):
+        # Unknown document or stale edit: the client has to send the full text
+        return jsonify({'success': False, 'resync': True})
+    
+    try:
+        # Held to the limits of the whole edited document, not just the edit
+        tokens, changed, error = relex(old, offset, deleted, inserted, request_budget())
+    except BudgetExceeded as e:
+        forget_document(doc_id)
+        return budget_response(e.error)
+    if error:
+        forget_document(doc_id)
+        return jsonify({
+            'success': False,
+            'error': error.as_string(),
+            'tokens': 0,
+            'token_list': [],
+            'token_values': []
+        })
+    
+    remember_document(doc_id, tokens)
+    first, old_stop, new_stop = changed
+    token_list, token_values = serialize_tokens(tokens, first, new_stop)
+    response_data = {
+        'success': True,
+        'doc': doc_id,
+        'first': first,
+        'old_stop': old_stop,
+        'tokens': len(tokens) - 1,  # -1 because of EOF token
+        'token_list': token_list,
+        'token_values': token_values
+    }
+    # No parse result: parsing walks the whole stream, so it is left to /parse
+    return jsonify(response_data)
+
+@app.route('/parse/<doc_id>')
+def parse_document(doc_id):
+    """Parse result of a document's last token stream, fetched after a delta's tokens are shown"""
+    tokens = recall_document(doc_id, relexable=False)
+    if tokens is None:
+        # Evicted or never seen: the client has to run the code again
+        return jsonify({'success': False, 'resync': True}), 404
+    try:
+        result = IterativeParser(tokens, budget=request_budget()).parse().node
+    except BudgetExceeded as e:
+        return budget_response(e.error)
+    return jsonify({
+        'success': True,
+        'doc': doc_id,
+        'result': str(result) if result is not None else ""
+    })
 
 @app.route('/execute_file', methods=['POST'])
 def execute_file():
+    fmt = response_format()
+    if fmt is None:
+        return unknown_format()
+    data = request.get_json(silent=True) or {}
+    name = data.get('path') or request.args.get('path') or DEFAULT_FILE
+    doc_id = data.get('doc')
+    if not valid_doc(doc_id):
+        return bad_doc()
     try:
-        file_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test.txt')
-        if not os.path.exists(file_path):
+        file_path = sandboxed_path(name)
+        if file_path is None:
+            return jsonify({
+                'success': False,
+                'error': f'{name} is outside the files directory, hidden or not a valid name'
+            }), 403
+        if not os.path.isfile(file_path):
              return jsonify({
                 'success': False,
-                'error': 'test.txt file not found in project directory'
+                'error': f'{name} file not found in the files directory'
             })
-            
-        with open(file_path, 'r') as f:
-            code = f.read()
-            
-        return process_code(code)
+        
+        stat = os.stat(file_path)
+        version = f'{stat.st_mtime_ns:x}-{stat.st_size:x}'
+        etag = version if fmt == 'json' else f'{version}-{fmt}'
+        if request.if_none_match.contains(etag):
+            # Unchanged since the client's copy: no read, no lexing
+            response = app.response_class(status=304)
+            response.set_etag(etag)
+            return response
+        
+        cached = file_cache.get(file_path)
+        if cached is not None and cached[0] == version:
+            response_data, tokens = cached[1], cached[2]
+        else:
+            response_data, tokens = build_file_result(file_path, budget=request_budget())
+            if tokens is None:
+                # Over budget: counted, and left uncached like an over-budget /execute
+                metrics.observe_budget(response_data['budget'])
+                return jsonify(response_data)
+            file_cache.put(file_path, (version, response_data, tokens),
+                           result_size(response_data['executed_code'], response_data))
+        
+        if doc_id:
+            # Kept for paging only: the editor starts a fresh document from the file
+            remember_document(doc_id, tokens, relexable=False)
+        if fmt == 'json':
+            response_data = token_lists(response_data, tokens, page_size(data.get('page')))
+        response = format_response(response_data, tokens, fmt)
+        response.set_etag(etag)
+        return response
     except Exception as e:
         return jsonify({
             'success': False,
             'error': f'Error reading file: {str(e)}'
         })
 
-def process_code(code):
-    if not code.strip():
+@app.route('/execute_batch', methods=['POST'])
+def execute_batch():
+    """Lex and parse many programs at once across a process pool"""
+    data = request.get_json()
+    sources = data.get('sources') if data else None
+    if not isinstance(sources, list) or not all(isinstance(code, str) for code in sources):
         return jsonify({
             'success': False,
-            'error': 'Please enter some code to execute'
-        })
+            'error': 'Expected a JSON object with a "sources" array of strings'
+        }), 400
+    if len(sources) > MAX_BATCH_SIZE:
+        return jsonify({
+            'success': False,
+            'error': f'Batch too large: {len(sources)} sources, the limit is {MAX_BATCH_SIZE}'
+        }), 413
+    
+    results = run_batch(sources, BATCH_ITEM_TIMEOUT)
+    for result in results:
+        if 'budget' in result:
+            # Counted here: the workers' counters are not the ones /metrics shows
+            metrics.observe_budget(result['budget'])
+    return jsonify({
+        'success': True,
+        'results': results
+    })
+
+@app.route('/stats', methods=['POST'])
+def stats():
+    """Token type, token length and identifier statistics over one or many sources"""
+    data = request.get_json(silent=True) or {}
+    sources = [data['code']] if isinstance(data.get('code'), str) else data.get('sources', [])
+    paths = data.get('paths', [])
+    top = data.get('top', TOP_IDENTIFIERS)
+    if (not isinstance(sources, list) or not all(isinstance(code, str) for code in sources)
+            or not isinstance(paths, list) or not all(isinstance(name, str) for name in paths)
+            or not isinstance(top, int) or top < 0):
+        return jsonify({
+            'success': False,
+            'error': 'Expected a JSON object with "code" or a "sources" array of strings, '
+                     'a "paths" array of file names, or both, and an optional "top" count'
+        }), 400
+    if len(sources) + len(paths) > MAX_BATCH_SIZE:
+        return jsonify({
+            'success': False,
+            'error': f'Too many inputs: {len(sources) + len(paths)}, the limit is {MAX_BATCH_SIZE}'
+        }), 413
     
-    # Import Lexer to get token list
-    from basic import Lexer
+    aggregate = TokenStats()
+    budget = request_budget()
+    for code in sources:
+        lexer = FastLexer('<stdin>', code)
+        try:
+            tokens, errors = lexer.make_tokens_recovering(MAX_DIAGNOSTICS, budget=budget)
+        except BudgetExceeded as e:
+            return budget_response(e.error)
+        aggregate.add(tokens, lexer.error_count)
+    for name in paths:
+        file_path = sandboxed_path(name)
+        if file_path is None:
+            return jsonify({
+                'success': False,
+                'error': f'{name} is outside the files directory, hidden or not a valid name'
+            }), 403
+        if not os.path.isfile(file_path):
+            return jsonify({
+                'success': False,
+                'error': f'{name} file not found in the files directory'
+            })
+        lexer = FileLexer('<file>', file_path)
+        try:
+            tokens, errors = lexer.make_tokens_recovering(MAX_DIAGNOSTICS, budget)
+        except BudgetExceeded as e:
+            return budget_response(e.error)
+        except (OSError, ValueError) as e:
+            # Not UTF-8, or gone since it was checked
+            return jsonify({
+                'success': False,
+                'error': f'Error reading {name}: {e}'
+            })
+        aggregate.add(tokens, lexer.error_count)
     
-    # Get tokens from lexer
-    lexer = Lexer('<web>', code)
-    tokens, lexer_error = lexer.make_tokens()
+    return jsonify({'success': True, **aggregate.as_dict(top)})
+
+@app.route('/live/<doc_id>')
+def live_stream(doc_id):
+    """Server-Sent Events stream of results for the revisions posted to /live/<doc_id>"""
+    session = live_channel.open(doc_id, page=page_size(request.args.get('page', type=int)))
+    response = app.response_class(live_channel.events(doc_id, session), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@app.route('/tokens/<doc_id>')
+def token_page(doc_id):
+    """A slice of the token lists of a document's last result, for clients paging through them"""
+    tokens = recall_document(doc_id, relexable=False)
+    if tokens is None:
+        # Evicted or never seen: the client has to run the code again
+        return jsonify({'success': False, 'resync': True}), 404
+    start = request.args.get('start', 0, type=int)
+    count = request.args.get('count', TOKEN_PAGE_SIZE, type=int)
+    if start < 0 or count < 0:
+        return jsonify({
+            'success': False,
+            'error': 'start and count must not be negative'
+        }), 400
+    stop = min(start + min(count, MAX_TOKEN_PAGE), len(tokens))
+    token_list, token_values = serialize_tokens(tokens, start, stop) if start < stop else ([], [])
+    return jsonify({
+        'success': True,
+        'doc': doc_id,
+        'start': start,
+        'total': len(tokens),
+        'token_list': token_list,
+        'token_values': token_values
+    })
+
+@app.route('/live/<doc_id>', methods=['POST'])
+def live_update(doc_id):
+    """Post a revision of a live document; superseded revisions are never lexed"""
+    data = request.get_json(silent=True) or {}
+    rev = data.get('rev')
+    code = data.get('code')
+    if not isinstance(rev, int) or not isinstance(code, str):
+        return jsonify({
+            'success': False,
+            'error': 'Expected a JSON object with an integer "rev" and a "code" string'
+        }), 400
+    session = live_channel.get(doc_id)
+    if session is None:
+        # No stream open for this document: the client has to (re)connect first
+        return jsonify({'success': False, 'reconnect': True}), 404
+    accepted = session.update(rev, code)
+    return jsonify({'success': True, 'rev': rev, 'accepted': accepted}), 202
+
+@app.route('/cache/stats')
+def cache_stats():
+    return jsonify({
+        'results': result_cache.stats(),
+        'files': file_cache.stats(),
+        'programs': program_cache.stats()
+    })
+
+def response_format():
+    """The requested response format, or None if ?format= names an unknown one"""
+    name = request.args.get('format')
+    if name:
+        return name if name in RESPONSE_FORMATS.values() else None
+    return RESPONSE_FORMATS[request.accept_mimetypes.best_match(list(RESPONSE_FORMATS), 'application/json')]
+
+def unknown_format():
+    return jsonify({
+        'success': False,
+        'error': f'Unknown format, expected one of: {", ".join(RESPONSE_FORMATS.values())}'
+    }), 400
+
+def valid_doc(doc_id):
+    """Whether a request's "doc" can name a document; leaving it out is fine"""
+    return doc_id is None or isinstance(doc_id, str)
+
+def bad_doc():
+    return jsonify({
+        'success': False,
+        'error': '"doc" must be a string'
+    }), 400
+
+def process_code(code, doc_id=None, want_timings=False, fmt='json', page=None):
+    timings = {} if want_timings or metrics.enabled else None
+    response_data, tokens = code_result(code, doc_id, timings)
+    if fmt == 'json':
+        response_data = token_lists(response_data, tokens, page, timings)
+    if want_timings:
+        # The cached dict is shared, so add the timings to a copy
+        response_data = dict(response_data, timings=timings)
     
-    # Create token list and token values for display
-    token_list = []
-    token_values = []
+    if timings is None:
+        return format_response(response_data, tokens, fmt)
+    start = time.perf_counter()
+    response = format_response(response_data, tokens, fmt)
+    metrics.observe_phases({'json_ms': (time.perf_counter() - start) * 1000})
+    return response
+
+def format_response(response_data, tokens, fmt):
+    """Render a result in the negotiated format"""
+    if fmt == 'compact' and tokens is not None:
+        response = jsonify(compact_result(response_data, tokens))
+        response.mimetype = COMPACT_MIMETYPE
+    elif fmt == 'stream' and tokens is not None:
+        response = app.response_class(stream_result(response_data, tokens), mimetype='application/json')
+    else:
+        response = jsonify(with_token_lists(response_data, tokens))
+    response.vary.add('Accept')
+    return response
+
+def code_result(code, doc_id=None, timings=None, cancelled=None):
+    """
+    Response data (without the token lists) and token stream for code,
+    served from the result cache when possible. Phase timings are recorded
+    into the timings dict if one is given; cancelled is passed on to the
+    lexer (see run_recovering).
+    """
+    if not code.strip():
+        return {
+            'success': False,
+            'error': 'Please enter some code to execute'
+        }, None
     
-    # Map token types to their symbols
-    token_symbols = {
-        'PLUS': '+', 'MINUS': '-', 'MUL': '*', 'DIV': '/',
-        'LPAREN': '(', 'RPAREN': ')', 'LSQUARE': '[', 'RSQUARE': ']',
-        'COMMA': ',', 'COLON': ':', 'EQ': '=', 'EQEQ': '==',
-        'LT': '<', 'LTE': '<=', 'GT': '>', 'GTE': '>=',
-        'INCREMENT': '++', 'DECREMENT': '--', 'EOF': ''
-    }
+    budget = request_budget()
+    try:
+        # Checked before the source is even hashed
+        budget.check_source('<web>', code)
+    except BudgetExceeded as e:
+        metrics.observe_budget(e.error.limit)
+        return budget_result(e.error), None
     
-    if tokens:
-        for token in tokens:
-            # Token type
-            token_type = str(token.type) if hasattr(token, 'type') else str(token)
-            token_list.append(token_type)
-            
-            # Token value (actual text representation)
-            if hasattr(token, 'value') and token.value is not None:
-                # Has a value (like numbers, identifiers, keywords)
-                token_values.append(str(token.value))
-            elif token_type in token_symbols:
-                # Use symbol mapping for operators
-                token_values.append(token_symbols[token_type])
-            else:
-                # Unknown token type
-                token_values.append('')
+    key = source_key(code)
+    cached = result_cache.get(key)
+    if cached is None:
+        cached = build_result(code, timings, cancelled, budget)
+        if 'budget' in cached[0]:
+            metrics.observe_budget(cached[0]['budget'])
+        if cached[0].get('budget') != 'time':
+            # Running out of time depends on the load, the other limits only on the source
+            result_cache.put(key, cached, result_size(code, cached[0]))
+        if timings is not None:
+            timings['cache'] = 'miss'
+            metrics.observe_phases(timings)
+    elif timings is not None:
+        timings['cache'] = 'hit'
     
-    # Run the interpreter
-    result, error, token_count = run('<web>', code)
+    response_data, tokens = cached
+    if doc_id and tokens is not None:
+        remember_document(doc_id, tokens, response_data['success'])
+    return response_data, tokens
+
+def build_result(code, timings=None, cancelled=None, budget=None):
+    """
+    Lex and parse code, returning the response data and the token stream.
+    The token_list/token_values lists are left to with_token_lists so the
+    other response formats never build them. Lexing and parsing are held to
+    budget, by default a fresh request_budget(); a source that runs out of
+    it gets budget_result data and no token stream.
+    """
+    if budget is None:
+        budget = request_budget()
+    # Lex and parse in one pass, keeping the token stream for display.
+    # Lexing carries on past illegal characters so all of them are reported.
+    try:
+        result, errors, tokens = run_recovering('<web>', code, MAX_DIAGNOSTICS, timings, cancelled, budget)
+    except BudgetExceeded as e:
+        return budget_result(e.error), None
+    return result_data(code, result, errors, tokens)
+
+def request_budget():
+    """A Budget with the per-request limits, its clock starting now"""
+    return Budget(MAX_SOURCE_BYTES, MAX_TOKENS, MAX_DEPTH, TIME_BUDGET)
+
+def budget_result(error):
+    """Response data for a source stopped by a BudgetExceededError"""
+    return {
+        'success': False,
+        'error': error.as_string(),
+        'budget': error.limit,
+        'tokens': 0
+    }
+
+def budget_response(error):
+    metrics.observe_budget(error.limit)
+    return jsonify(budget_result(error))
+
+def build_file_result(file_path, timings=None, budget=None):
+    """build_result for a file, lexed from a memory map where possible"""
+    start = time.perf_counter() if timings is not None else 0
+    try:
+        tokens, errors = lex_file('<file>', file_path, MAX_DIAGNOSTICS, budget)
+        if timings is not None:
+            timings['lex_ms'] = (time.perf_counter() - start) * 1000
+        # The editor shows the file, so this is the one full decode; the stream
+        # is cached and paged from later, so it keeps the text, not the mapping
+        code = detach(tokens, errors)
+        result, errors, tokens = parse_lexed(tokens, errors, timings, budget)
+    except BudgetExceeded as e:
+        return budget_result(e.error), None
+    return result_data(code, result, errors, tokens)
+
+def result_data(code, result, errors, tokens):
+    token_count = max(len(tokens) - 1, 0)  # -1 because of EOF token
+    metrics.observe_lexed(len(code), token_count)
     
     response_data = {
         'executed_code': code,
-        'tokens': token_count,
-        'token_list': token_list,
-        'token_values': token_values
+        'tokens': token_count
     }
     
     # We want to show tokens even if there's a parser error
@@ -103,13 +668,191 @@ def process_code(code):
     response_data['success'] = True
     response_data['result'] = str(result) if result is not None else ""
     
-    # Only treat as a failure if it's a lexer error (no tokens generated)
+    # Only treat lexer errors as a failure
     # This keeps things focused on Lexical Analysis as requested
-    if error and not token_list:
+    lexer_errors = [error for error in errors if isinstance(error, IllegalCharError)]
+    if lexer_errors:
         response_data['success'] = False
-        response_data['error'] = error.as_string()
+        response_data['errors'] = [error.as_string() for error in lexer_errors]
+        response_data['error'] = '\n\n'.join(response_data['errors'])
         
-    return jsonify(response_data)
+    return response_data, tokens
+
+def sandboxed_path(name):
+    """
+    Absolute path of name inside FILES_DIR, or None if it resolves outside,
+    names a hidden (dot) file or directory, as written or once resolved, or
+    is no path at all (an embedded NUL)
+    """
+    try:
+        file_path = os.path.realpath(os.path.join(FILES_DIR, name))
+    except ValueError:
+        return None
+    if os.path.commonpath([file_path, FILES_DIR]) != FILES_DIR:
+        return None
+    parts = name.replace('\\', '/').split('/') + os.path.relpath(file_path, FILES_DIR).split(os.sep)
+    if any(part.startswith('.') and part != '.' for part in parts):
+        return None
+    return file_path
+
+def page_size(value):
+    """A requested first-page size, or None for all tokens at once"""
+    if isinstance(value, int) and not isinstance(value, bool) and value > 0:
+        return min(value, MAX_TOKEN_PAGE)
+    return None
+
+def token_lists(response_data, tokens, page=None, timings=None):
+    """
+    response_data with its token lists: all of them, or with a page size and
+    more tokens than that, only the first page, marked 'paged' and with the
+    'total' list length so the client can fetch the rest from /tokens
+    """
+    if page is None or tokens is None or len(tokens) <= page:
+        return with_token_lists(response_data, tokens, timings)
+    token_list, token_values = serialize_tokens(tokens, 0, page)
+    # The cached dict is shared, so the page goes into a copy
+    return dict(response_data, token_list=token_list, token_values=token_values,
+                paged=True, total=len(tokens))
+
+def with_token_lists(response_data, tokens, timings=None):
+    """
+    Add the token_list/token_values lists to response_data. They are stored
+    in the (cached) dict itself, so they are built once per result.
+    """
+    if tokens is None or 'token_list' in response_data:
+        return response_data
+    start = time.perf_counter()
+    token_list, token_values = serialize_tokens(tokens)
+    response_data['token_list'] = token_list
+    response_data['token_values'] = token_values
+    serialize_ms = (time.perf_counter() - start) * 1000
+    if timings is not None:
+        timings['serialize_ms'] = serialize_ms
+    metrics.observe_phases({'serialize_ms': serialize_ms})
+    return response_data
+
+def stream_result(response_data, tokens):
+    """
+    Yield a result as the same JSON object as the default format, with the
+    token lists serialized STREAM_CHUNK_TOKENS tokens at a time
+    """
+    head = {key: value for key, value in response_data.items()
+            if key != 'token_list' and key != 'token_values'}
+    yield json.dumps(head, separators=(',', ':'))[:-1]
+    
+    count = len(tokens)
+    for name in ('token_list', 'token_values'):
+        yield f',"{name}":['
+        for start in range(0, count, STREAM_CHUNK_TOKENS):
+            stop = min(start + STREAM_CHUNK_TOKENS, count)
+            if name == 'token_list':
+                chunk = [TOKEN_TYPES[type_id] for type_id in tokens.types[start:stop]]
+            else:
+                chunk = serialize_tokens(tokens, start, stop)[1]
+            yield (',' if start else '') + json.dumps(chunk, separators=(',', ':'))[1:-1]
+        yield ']'
+    yield '}'
+
+def batch_item(code):
+    """Worker entry point for /execute_batch: the response data of process_code"""
+    if not code.strip():
+        return {
+            'success': False,
+            'error': 'Please enter some code to execute'
+        }
+    return with_token_lists(*build_result(code))
+
+def get_batch_pool():
+    global batch_pool
+    with batch_pool_lock:
+        if batch_pool is None:
+            batch_pool = ProcessPoolExecutor(max_workers=BATCH_WORKERS)
+        return batch_pool
+
+def reset_batch_pool(pool):
+    """Kill a pool whose workers may be stuck on a pathological input"""
+    global batch_pool
+    with batch_pool_lock:
+        if batch_pool is pool:
+            batch_pool = None
+    # ProcessPoolExecutor cannot cancel running work, so terminate its workers
+    for process in list((pool._processes or {}).values()):
+        process.terminate()
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def run_batch(sources, item_timeout):
+    """
+    Run batch_item over sources in the process pool, keeping input order.
+    An item that does not finish within item_timeout of being waited on is
+    reported as timed out; the pool is then replaced and any unfinished
+    items are resubmitted to the fresh one. When a worker dies the pool is
+    replaced as well and the unfinished items are run one at a time from
+    then on, so an item that kills its worker is found and reported as
+    failed instead of failing the batch or being retried forever.
+    """
+    results = [None] * len(sources)
+    pending = list(range(len(sources)))
+    isolate = False
+    
+    while pending:
+        pool = get_batch_pool()
+        batch = pending[:1] if isolate else pending
+        try:
+            futures = {i: pool.submit(batch_item, sources[i]) for i in batch}
+        except (BrokenProcessPool, RuntimeError):
+            # Broken, or shut down by another request, since it was handed out
+            reset_batch_pool(pool)
+            continue
+        retry = []
+        for n, i in enumerate(batch):
+            try:
+                results[i] = futures[i].result(timeout=item_timeout)
+                continue
+            except FutureTimeoutError:
+                results[i] = {
+                    'success': False,
+                    'error': f'Time limit of {item_timeout:g}s exceeded'
+                }
+            except BrokenProcessPool:
+                with batch_pool_lock:
+                    replaced = batch_pool is not pool
+                if replaced or not isolate:
+                    # Another request replaced the pool under us, or one of
+                    # the items killed its worker: run the rest alone to find it
+                    isolate = isolate or not replaced
+                    retry.append(i)
+                else:
+                    results[i] = {
+                        'success': False,
+                        'error': 'The worker process died while processing this source'
+                    }
+            
+            # Collect whatever else already finished, then start over
+            for j in batch[n + 1:]:
+                future = futures[j]
+                if future.done() and not future.cancelled() and future.exception() is None:
+                    results[j] = future.result()
+                else:
+                    retry.append(j)
+            reset_batch_pool(pool)
+            break
+        
+        pending = retry + pending[len(batch):]
+    
+    return results
+
+def result_size(code, response_data):
+    """Rough memory footprint of a cached result, used for the cache byte limit"""
+    return 2 * len(code) + 160 * (response_data.get('tokens', 0) + 1)
+
+def document_size(tokens):
+    """Rough memory footprint of a remembered token stream, used for the document byte limit"""
+    columns = (tokens.types, tokens.starts, tokens.ends, tokens.symbol_ids)
+    return 2 * len(tokens.text) + len(tokens) * sum(column.itemsize for column in columns)
+
+def program_size(code, program):
+    """Rough memory footprint of a compiled program, used for the cache byte limit"""
+    return 2 * len(code) + 400 * (program.size if program is not None else 1)
 
 if __name__ == '__main__':
     print("🚀 Basic Interpreter UI is running!")
@@ -4,12 +4,28 @@
 
 from strings_with_arrows import *
 import random
+import re
+import time
+from array import array
+from bisect import bisect_right
+from collections import Counter
+from token_dfa import compile_spec, longest_match
 
 #######################################
 # CONSTANTS
 #######################################
 
 DIGITS = '0123456789'
+CHUNK_SIZE = 64 * 1024
+# Characters of the current line iter_tokens keeps on either side of the
+# scan position, for an error snippet
+SNIPPET_CHARS = 1024
+MAX_ERRORS = 100
+# Source characters lexed between two checks of a cancelled() callback or
+# of a Budget's token count and clock
+CANCEL_CHECK_CHARS = 16 * 1024
+# Tokens parsed between two checks of a Budget's clock
+BUDGET_CHECK_TOKENS = 4096
 KEYWORDS = [
     'if', 'else', 'elif', 'while', 'for', 'def', 'class',
     'return', 'break', 'continue', 'pass', 'import', 'from',
@@ -27,12 +43,17 @@ class Error:
         self.pos_end = pos_end
         self.error_name = error_name
         self.details = details
+        self._string = None
 
     def as_string(self):
-        result = f'{self.error_name}: {self.details}\n'
-        result += f'File {self.pos_start.fn}, line {self.pos_start.ln + 1}'
-        result += '\n\n' + string_with_arrows(self.pos_start.ftxt, self.pos_start, self.pos_end)
-        return result
+        # Rendered on first request only, then reused
+        if self._string is None:
+            self._string = (
+                f'{self.error_name}: {self.details}\n'
+                f'File {self.pos_start.fn}, line {self.pos_start.ln + 1}'
+                '\n\n' + string_with_arrows(self.pos_start.ftxt, self.pos_start, self.pos_end)
+            )
+        return self._string
 
 class IllegalCharError(Error):
     def __init__(self, pos_start, pos_end, details):
@@ -42,11 +63,35 @@ class InvalidSyntaxError(Error):
     def __init__(self, pos_start, pos_end, details=''):
         super().__init__(pos_start, pos_end, 'Invalid Syntax', details)
 
+class RTError(Error):
+    def __init__(self, pos_start, pos_end, details):
+        super().__init__(pos_start, pos_end, 'Runtime Error', details)
+
+class BudgetExceededError(Error):
+    def __init__(self, pos_start, pos_end, details, limit):
+        super().__init__(pos_start, pos_end, 'Budget Exceeded', details)
+        self.limit = limit  # 'bytes', 'tokens', 'depth' or 'time'
+
+    def as_string(self):
+        # No snippet: the line could be all of an oversized source
+        return f'{self.error_name}: {self.details}\nFile {self.pos_start.fn}, line {self.pos_start.ln + 1}'
+
+class Cancelled(Exception):
+    """Raised when a cancelled() callback passed to the lexer returns True"""
+
+class BudgetExceeded(Exception):
+    """Raised when lexing or parsing runs out of a Budget; error is the BudgetExceededError"""
+    def __init__(self, error):
+        super().__init__(error.details)
+        self.error = error
+
 #######################################
 # POSITION
 #######################################
 
 class Position:
+    __slots__ = ('idx', 'ln', 'col', 'fn', 'ftxt')
+
     def __init__(self, idx, ln, col, fn, ftxt):
         self.idx = idx
         self.ln = ln
@@ -94,7 +139,58 @@ TT_INCREMENT = 'INCREMENT'
 TT_DECREMENT = 'DECREMENT'
 TT_EOF       = 'EOF'
 
+# Every token type, in type-id order, as (type, symbol, pattern): a type is
+# recognised by its literal symbol or by its pattern, and where two patterns
+# match the same text the earlier row wins. KEYWORD has neither, keywords
+# being the IDENTIFIER matches listed in KEYWORDS. The lexers and the web
+# serializer are generated from this table (see token_dfa.py).
+TOKEN_SPEC = (
+    (TT_FLOAT,      None, r'[0-9]+\.[0-9]*'),
+    (TT_INT,        None, r'[0-9]+'),
+    (TT_STRING,     None, r'"[^"]*"?'),
+    (TT_IDENTIFIER, None, r'[^\W\d]\w*'),
+    (TT_KEYWORD,    None, None),
+    (TT_PLUS,       '+',  None),
+    (TT_MINUS,      '-',  None),
+    (TT_MUL,        '*',  None),
+    (TT_DIV,        '/',  None),
+    (TT_LPAREN,     '(',  None),
+    (TT_RPAREN,     ')',  None),
+    (TT_LSQUARE,    '[',  None),
+    (TT_RSQUARE,    ']',  None),
+    (TT_COMMA,      ',',  None),
+    (TT_COLON,      ':',  None),
+    (TT_EQ,         '=',  None),
+    (TT_EQEQ,       '==', None),
+    (TT_LT,         '<',  None),
+    (TT_LTE,        '<=', None),
+    (TT_GT,         '>',  None),
+    (TT_GTE,        '>=', None),
+    (TT_INCREMENT,  '++', None),
+    (TT_DECREMENT,  '--', None),
+    (TT_EOF,        None, None),
+)
+
+# Lexemes that separate tokens without being tokens, as (name, pattern)
+IGNORED_SPEC = (
+    ('SKIP',    r'[ \t\n]+'),
+    ('COMMENT', r'#[^\n\r]*'),
+)
+
+TOKEN_TABLE = compile_spec(TOKEN_SPEC, IGNORED_SPEC)
+
+# Token type ids used by the columnar TokenStream
+TOKEN_TYPES = tuple(type_ for type_, symbol, pattern in TOKEN_SPEC)
+TYPE_IDS = {type_: i for i, type_ in enumerate(TOKEN_TYPES)}
+
+# type -> symbol for the types spelled the same way every time
+TOKEN_SYMBOLS = TOKEN_TABLE['symbols']
+# First characters of those symbols: the operator DFA's moves out of its start state
+OPERATOR_STARTS = TOKEN_TABLE['transitions'][0]
+
 class Token:
+    __slots__ = ('type', 'value', 'pos_start', 'pos_end')
+
     def __init__(self, type_, value=None, pos_start=None, pos_end=None):
         self.type = type_
         self.value = value
@@ -108,6 +204,212 @@ class Token:
     def __repr__(self):
         return self.value if self.value is not None else self.type
 
+#######################################
+# TOKEN STREAM
+#######################################
+
+ID_INT, ID_FLOAT, ID_STRING = TYPE_IDS[TT_INT], TYPE_IDS[TT_FLOAT], TYPE_IDS[TT_STRING]
+ID_IDENTIFIER, ID_KEYWORD, ID_EOF = TYPE_IDS[TT_IDENTIFIER], TYPE_IDS[TT_KEYWORD], TYPE_IDS[TT_EOF]
+
+KEYWORD_COUNT = len(KEYWORDS)
+
+def offset_typecode(length):
+    """
+    Array typecode for offsets into a text of this length (up to the EOF
+    token's end): 4-byte unsigned below 4 GB, which halves the two widest
+    token columns, 8-byte otherwise
+    """
+    return 'I' if length < 2 ** 32 - 1 else 'q'
+
+class SymbolTable:
+    """
+    Interned identifier and keyword names of one lex, numbered in order of
+    first appearance after the keywords, which always take ids
+    0..KEYWORD_COUNT-1. A name is a keyword exactly when its id is below
+    KEYWORD_COUNT.
+    """
+    def __init__(self):
+        self.names = list(KEYWORDS)
+        self.ids = {name: i for i, name in enumerate(KEYWORDS)}
+
+    def __len__(self):
+        return len(self.names)
+
+    def intern(self, name):
+        """Id of name, adding it if new"""
+        symbol = self.ids.get(name)
+        if symbol is None:
+            symbol = self.add(name)
+        return symbol
+
+    def add(self, name):
+        symbol = self.ids[name] = len(self.names)
+        self.names.append(name)
+        return symbol
+
+    def copy(self):
+        table = SymbolTable.__new__(SymbolTable)
+        table.names = self.names[:]
+        table.ids = self.ids.copy()
+        return table
+
+    def merge(self, names):
+        """
+        Add another table's names; returns the list mapping its ids to ids in
+        this table, with an extra -1 at the end so that a symbol column's -1
+        (no symbol) maps to itself
+        """
+        mapping = [self.intern(name) for name in names]
+        mapping.append(-1)
+        return mapping
+
+class TokenStream:
+    """
+    Columnar token list: type ids, start and end offsets into the source, and
+    for identifiers and keywords the id of their name in self.symbols (-1 for
+    other tokens). Values, lines and columns are derived from the text on
+    demand and Token objects are only built when a caller indexes or iterates
+    the stream.
+    """
+    def __init__(self, fn, text, symbols=None):
+        self.fn = fn
+        self.text = text
+        offsets = offset_typecode(len(text))
+        self.types = array('B')
+        self.starts = array(offsets)
+        self.ends = array(offsets)
+        self.symbol_ids = array('i')
+        self.symbols = symbols if symbols is not None else SymbolTable()
+        self._line_starts = None
+
+    def __len__(self):
+        return len(self.types)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        tok = Token(TOKEN_TYPES[self.types[i]], self.value_of(i))
+        tok.pos_start = self.position(self.starts[i])
+        tok.pos_end = self.position(self.ends[i])
+        return tok
+
+    def __iter__(self):
+        # Walk the line index alongside the offsets instead of bisecting per token
+        fn, text = self.fn, self.text
+        line_starts = self.line_starts
+        last_line = len(line_starts) - 1
+        start_ln = end_ln = 0
+        for i in range(len(self)):
+            start, end = self.starts[i], self.ends[i]
+            while start_ln < last_line and line_starts[start_ln + 1] <= start:
+                start_ln += 1
+            if end_ln < start_ln:
+                end_ln = start_ln
+            while end_ln < last_line and line_starts[end_ln + 1] <= end:
+                end_ln += 1
+            tok = Token(TOKEN_TYPES[self.types[i]], self.value_of(i))
+            tok.pos_start = Position(start, start_ln, start - line_starts[start_ln], fn, text)
+            tok.pos_end = Position(end, end_ln, end - line_starts[end_ln], fn, text)
+            yield tok
+
+    def append(self, type_id, start, end, symbol=-1):
+        self.types.append(type_id)
+        self.starts.append(start)
+        self.ends.append(end)
+        self.symbol_ids.append(symbol)
+
+    def type_of(self, i):
+        return TOKEN_TYPES[self.types[i]]
+
+    def value_of(self, i):
+        type_id = self.types[i]
+        if type_id == ID_IDENTIFIER or type_id == ID_KEYWORD:
+            return self.symbols.names[self.symbol_ids[i]]
+        if type_id == ID_INT:
+            return int(self.text[self.starts[i]:self.ends[i]])
+        if type_id == ID_FLOAT:
+            return float(self.text[self.starts[i]:self.ends[i]])
+        if type_id == ID_STRING:
+            start, end = self.starts[i], self.ends[i]
+            closed = end - start > 1 and self.text[end - 1] == '"'
+            return self.text[start + 1:end - 1] if closed else self.text[start + 1:end]
+        return None
+
+    def symbol_counts(self):
+        """Number of tokens per symbol id, counted from the symbol column"""
+        counts = [0] * len(self.symbols)
+        for symbol, count in Counter(self.symbol_ids).items():
+            if symbol >= 0:
+                counts[symbol] = count
+        return counts
+
+    def occurrences(self):
+        """{name: count} of every identifier and keyword in the stream"""
+        return {name: count for name, count in zip(self.symbols.names, self.symbol_counts()) if count}
+
+    @property
+    def line_starts(self):
+        if self._line_starts is None:
+            # Shared with error rendering for the same source
+            self._line_starts = line_index(self.text).starts
+        return self._line_starts
+
+    def position(self, idx):
+        line_starts = self.line_starts
+        ln = bisect_right(line_starts, idx) - 1
+        return Position(idx, ln, idx - line_starts[ln], self.fn, self.text)
+
+#######################################
+# BUDGETS
+#######################################
+
+class Budget:
+    """
+    Resource limits for lexing and parsing one source, each None for no
+    limit: the source size in UTF-8 bytes, the number of tokens, the nesting
+    depth of brackets and the wall-clock seconds, counted from when the
+    Budget is made. The lexer checks the token count and the clock every
+    CANCEL_CHECK_CHARS characters, the parser the clock every
+    BUDGET_CHECK_TOKENS tokens, and both raise BudgetExceeded.
+    """
+    def __init__(self, max_bytes=None, max_tokens=None, max_depth=None, seconds=None):
+        self.max_bytes = max_bytes
+        self.max_tokens = max_tokens
+        self.max_depth = max_depth
+        self.seconds = seconds
+        self.deadline = time.monotonic() + seconds if seconds is not None else None
+
+    def too_large(self, text):
+        if self.max_bytes is None:
+            return False
+        if len(text) > self.max_bytes:
+            return True
+        # A character is at most 4 bytes, so most sources are settled by their length
+        return 4 * len(text) > self.max_bytes and len(text.encode('utf-8', 'surrogatepass')) > self.max_bytes
+
+    def out_of_time(self):
+        return self.deadline is not None and time.monotonic() > self.deadline
+
+    def check_source(self, fn, text):
+        if self.too_large(text):
+            pos = Position(0, 0, 0, fn, text)
+            self.exceeded('bytes', pos, pos)
+
+    def exceeded(self, limit, pos_start, pos_end):
+        """Raise BudgetExceeded for limit, stopped at pos_start..pos_end"""
+        # Only the limit that fired is set, so only its message is built
+        if limit == 'bytes':
+            details = f'Source larger than {self.max_bytes} bytes'
+        elif limit == 'tokens':
+            details = f'More than {self.max_tokens} tokens'
+        elif limit == 'depth':
+            details = f'Brackets nested deeper than {self.max_depth} levels'
+        else:
+            details = f'Time limit of {self.seconds:g}s exceeded'
+        raise BudgetExceeded(BudgetExceededError(pos_start, pos_end, details, limit))
+
 #######################################
 # LEXER
 #######################################
@@ -116,6 +418,7 @@ class Lexer:
     def __init__(self, fn, text):
         self.fn = fn
         self.text = text
+        self.symbols = SymbolTable()
         self.pos = Position(-1, 0, -1, fn, text)
         self.current_char = None
         self.advance()
@@ -136,38 +439,12 @@ class Lexer:
                     self.advance()
             elif self.current_char == '"':
                 tokens.append(self.make_string())
-            elif self.current_char == ',':
-                tokens.append(Token(TT_COMMA, pos_start=self.pos)); self.advance()
-            elif self.current_char == '=':
-                tokens.append(self.make_equals())
-            elif self.current_char == '<':
-                tokens.append(self.make_less_than())
-            elif self.current_char == '>':
-                tokens.append(self.make_greater_than())
             elif self.current_char in DIGITS:
                 tokens.append(self.make_number())
             elif self.current_char.isalpha() or self.current_char == '_':
                 tokens.append(self.make_identifier())
-            elif self.current_char == '+':
-                tokens.append(self.make_plus())
-            elif self.current_char == '-':
-                tokens.append(self.make_minus())
-            elif self.current_char == '*':
-                tokens.append(Token(TT_MUL, pos_start=self.pos)); self.advance()
-            elif self.current_char == '/':
-                tokens.append(Token(TT_DIV, pos_start=self.pos)); self.advance()
-            elif self.current_char == '(':
-                tokens.append(Token(TT_LPAREN, pos_start=self.pos)); self.advance()
-            elif self.current_char == ')':
-                tokens.append(Token(TT_RPAREN, pos_start=self.pos)); self.advance()
-            elif self.current_char == '[':
-                tokens.append(Token(TT_LSQUARE, pos_start=self.pos)); self.advance()
-            elif self.current_char == ']':
-                tokens.append(Token(TT_RSQUARE, pos_start=self.pos)); self.advance()
-            elif self.current_char == ':':
-                tokens.append(Token(TT_COLON, pos_start=self.pos)); self.advance()
-            elif self.current_char == ',':
-                tokens.append(Token(TT_COMMA, pos_start=self.pos)); self.advance()
+            elif self.current_char in OPERATOR_STARTS:
+                tokens.append(self.make_operator())
             else:
                 pos_start = self.pos.copy()
                 char = self.current_char
@@ -187,9 +464,9 @@ class Lexer:
             num_str += self.current_char
             self.advance()
         if dot_count == 0:
-            return Token(TT_INT, int(num_str), pos_start, self.pos)
+            return Token(TT_INT, int(num_str), pos_start, self.pos.copy())
         else:
-            return Token(TT_FLOAT, float(num_str), pos_start, self.pos)
+            return Token(TT_FLOAT, float(num_str), pos_start, self.pos.copy())
 
     def make_identifier(self):
         id_str = ''
@@ -198,67 +475,21 @@ class Lexer:
             id_str += self.current_char
             self.advance()
         
-        # Check if it's a keyword
-        if id_str in KEYWORDS:
-            return Token(TT_KEYWORD, id_str, pos_start, self.pos)
+        # Share one string per name; keywords are the first symbol ids
+        symbol = self.symbols.intern(id_str)
+        if symbol < KEYWORD_COUNT:
+            return Token(TT_KEYWORD, self.symbols.names[symbol], pos_start, self.pos.copy())
         else:
-            return Token(TT_IDENTIFIER, id_str, pos_start, self.pos)
+            return Token(TT_IDENTIFIER, self.symbols.names[symbol], pos_start, self.pos.copy())
     
-    def make_equals(self):
-        """Handle = and == with lookahead"""
+    def make_operator(self):
+        """Longest symbol at the current position, by walking the operator DFA"""
         pos_start = self.pos.copy()
-        self.advance()
-        
-        if self.current_char == '=':
+        type_, end = longest_match(TOKEN_TABLE, self.text, self.pos.idx)
+        while self.pos.idx < end:
             self.advance()
-            return Token(TT_EQEQ, pos_start=pos_start, pos_end=self.pos)
-        else:
-            return Token(TT_EQ, pos_start=pos_start, pos_end=self.pos)
-    
-    def make_less_than(self):
-        """Handle < and <= with lookahead"""
-        pos_start = self.pos.copy()
-        self.advance()
-        
-        if self.current_char == '=':
-            self.advance()
-            return Token(TT_LTE, pos_start=pos_start, pos_end=self.pos)
-        else:
-            return Token(TT_LT, pos_start=pos_start, pos_end=self.pos)
-    
-    def make_greater_than(self):
-        """Handle > and >= with lookahead"""
-        pos_start = self.pos.copy()
-        self.advance()
-        
-        if self.current_char == '=':
-            self.advance()
-            return Token(TT_GTE, pos_start=pos_start, pos_end=self.pos)
-        else:
-            return Token(TT_GT, pos_start=pos_start, pos_end=self.pos)
-    
-    def make_plus(self):
-        """Handle + and ++ with lookahead"""
-        pos_start = self.pos.copy()
-        self.advance()
-        
-        if self.current_char == '+':
-            self.advance()
-            return Token(TT_INCREMENT, pos_start=pos_start, pos_end=self.pos)
-        else:
-            return Token(TT_PLUS, pos_start=pos_start, pos_end=self.pos)
-    
-    def make_minus(self):
-        """Handle - and -- with lookahead"""
-        pos_start = self.pos.copy()
-        self.advance()
-        
-        if self.current_char == '-':
-            self.advance()
-            return Token(TT_DECREMENT, pos_start=pos_start, pos_end=self.pos)
-        else:
-            return Token(TT_MINUS, pos_start=pos_start, pos_end=self.pos)
-        
+        return Token(type_, pos_start=pos_start, pos_end=self.pos.copy())
+
     def make_string(self):
         string = ''
         pos_start = self.pos.copy()
@@ -270,39 +501,461 @@ class Lexer:
 
         if self.current_char == '"':
             self.advance()  # skip closing quote
-            return Token(TT_STRING, string, pos_start, self.pos)
+            return Token(TT_STRING, string, pos_start, self.pos.copy())
+        else:
+            return Token(TT_STRING, string, pos_start, self.pos.copy())  # unterminated ok for demo
+
+#######################################
+# FAST LEXER
+#######################################
+
+# One alternative per lexeme kind, generated from TOKEN_SPEC: the ignored
+# lexemes, each pattern row in spec order, then every symbol longest first.
+# Whole lexemes are sliced out of the source instead of being built one
+# character at a time.
+TOKEN_RE = re.compile(TOKEN_TABLE['pattern'])
+
+OPERATORS = {symbol: type_ for type_, symbol in TOKEN_SYMBOLS.items()}
+
+OPERATOR_IDS = {symbol: TYPE_IDS[type_] for symbol, type_ in OPERATORS.items()}
+
+# Group numbers of TOKEN_RE, compared against Match.lastindex
+GROUPS = {name: i for i, name in enumerate(TOKEN_TABLE['groups']) if name}
+G_SKIP, G_COMMENT, G_OP = GROUPS['SKIP'], GROUPS['COMMENT'], GROUPS['OP']
+G_FLOAT, G_INT, G_STRING, G_IDENTIFIER = (GROUPS[type_] for type_ in (TT_FLOAT, TT_INT, TT_STRING, TT_IDENTIFIER))
+# Type id of each pattern group (-1 for groups that are not a token type)
+GROUP_TYPE_IDS = [TYPE_IDS.get(name, -1) for name in TOKEN_TABLE['groups']]
+
+class FastLexer:
+    """
+    Drop-in replacement for Lexer driven by a single precompiled pattern.
+    make_tokens returns a TokenStream, which indexes and iterates like a list.
+    """
+    def __init__(self, fn, text):
+        self.fn = fn
+        self.text = text
+
+    def make_tokens(self, budget=None):
+        stream = TokenStream(self.fn, self.text)
+        if budget is None:
+            idx, error = self.scan(stream, 0)
         else:
-            return Token(TT_STRING, string, pos_start, self.pos)  # unterminated ok for demo
+            budget.check_source(self.fn, self.text)
+            idx, error = self.scan_checked(stream, 0, budget=budget)
+        if error:
+            return [], error
+        stream.append(ID_EOF, idx, idx + 1)
+        return stream, None
+
+    def scan(self, stream, idx, sync=None, stop=None):
+        """
+        Append the tokens found from idx onwards to stream. If sync is given it
+        is called as sync(type_id, start, end) before each token is appended and
+        scanning stops at the first token it accepts. If stop is given no token
+        starting at or after it is scanned. Returns (idx, error).
+        """
+        text = self.text
+        length = len(text) if stop is None else min(stop, len(text))
+        match = TOKEN_RE.match
+        types, starts, ends, symbol_ids = stream.types, stream.starts, stream.ends, stream.symbol_ids
+        symbol_table = stream.symbols
+        symbols = symbol_table.ids
+
+        while idx < length:
+            m = match(text, idx)
+            group = m.lastindex if m else None
+
+            if group == G_SKIP or group == G_COMMENT:
+                idx = m.end()
+                continue
+
+            symbol = -1
+            if group == G_OP:
+                type_id = OPERATOR_IDS[m.group()]
+            elif group == G_IDENTIFIER:
+                value = m.group()
+                first = value[0]
+                if first.isalpha() or first == '_':
+                    symbol = symbols.get(value)
+                    if symbol is None:
+                        symbol = symbol_table.add(value)
+                    type_id = ID_KEYWORD if symbol < KEYWORD_COUNT else ID_IDENTIFIER
+                else:
+                    group = None
+            elif group is not None:
+                type_id = GROUP_TYPE_IDS[group]
+
+            if group is None:
+                pos_start = stream.position(idx)
+                pos_end = stream.position(idx + 1)
+                return idx, IllegalCharError(pos_start, pos_end, f"'{text[idx]}'")
+
+            end = m.end()
+            if sync is not None and sync(type_id, idx, end):
+                return idx, None
+            types.append(type_id)
+            starts.append(idx)
+            ends.append(end)
+            symbol_ids.append(symbol)
+            idx = end
+
+        return idx, None
+
+    def make_tokens_recovering(self, max_errors=MAX_ERRORS, cancelled=None, budget=None):
+        """
+        Like make_tokens, but skip illegal characters instead of stopping.
+        Each run of adjacent illegal characters is reported as one error; at
+        most max_errors are returned and self.error_count holds the total.
+        If cancelled is given it is called every CANCEL_CHECK_CHARS characters
+        and Cancelled is raised once it returns True; a budget is checked as
+        often (see Budget). Returns (tokens, errors).
+        """
+        text = self.text
+        stream = TokenStream(self.fn, text)
+        errors = []
+        self.error_count = 0
+        if cancelled is None and budget is None:
+            scan = self.scan
+        else:
+            if budget is not None:
+                budget.check_source(self.fn, text)
+            scan = lambda stream, idx: self.scan_checked(stream, idx, cancelled, budget)
+        idx, error = scan(stream, 0)
+        while error:
+            end = self.illegal_run_end(idx)
+            self.error_count += 1
+            if len(errors) < max_errors:
+                errors.append(IllegalCharError(
+                    stream.position(idx), stream.position(end), f"'{text[idx:end]}'"
+                ))
+            idx, error = scan(stream, end)
+        stream.append(ID_EOF, idx, idx + 1)
+        return stream, errors
+
+    def scan_checked(self, stream, idx, cancelled=None, budget=None, sync=None):
+        """
+        scan in slices of CANCEL_CHECK_CHARS, raising Cancelled between them
+        once cancelled(), and BudgetExceeded once the budget runs out
+        """
+        length = len(self.text)
+        while True:
+            if cancelled is not None and cancelled():
+                raise Cancelled()
+            if budget is not None:
+                self.check_budget(stream, idx, budget)
+            stop = idx + CANCEL_CHECK_CHARS
+            idx, error = self.scan(stream, idx, sync, stop)
+            # Short of stop without an error: sync accepted a token
+            if error or idx >= length or idx < stop:
+                if budget is not None:
+                    self.check_budget(stream, idx, budget)
+                return idx, error
+
+    def check_budget(self, stream, idx, budget):
+        if budget.max_tokens is not None and len(stream.types) > budget.max_tokens:
+            budget.exceeded('tokens', stream.position(idx), stream.position(idx + 1))
+        if budget.out_of_time():
+            budget.exceeded('time', stream.position(idx), stream.position(idx + 1))
+
+    def illegal_run_end(self, idx):
+        """End of the run of illegal characters starting at idx"""
+        text = self.text
+        length = len(text)
+        match = TOKEN_RE.match
+        idx += 1
+        while idx < length:
+            m = match(text, idx)
+            if m and (m.lastindex != G_IDENTIFIER or text[idx].isalpha() or text[idx] == '_'):
+                break
+            idx += 1
+        return idx
+
+    def iter_tokens(self, chunk_size=CHUNK_SIZE):
+        """
+        Yield Tokens as they are recognised. self.text may be a str, a file
+        object or any iterable of text chunks; only the unconsumed tail and
+        the current line are kept in memory. Lexing stops at the first
+        illegal character, which is left in self.error.
+
+        Positions carry global idx/ln/col. When the source is not a str they
+        have no ftxt, except the error, whose ftxt is the offending line(s)
+        and whose idx is relative to that snippet. The snippet holds at most
+        SNIPPET_CHARS on either side of the error, so memory stays bounded on
+        input without newlines; when it is cut short of the line start, col
+        is relative to it as well.
+        """
+        self.error = None
+        self.symbols = symbols = SymbolTable()
+        fn = self.fn
+        ftxt = self.text if isinstance(self.text, str) else None
+        chunks = self._chunks(chunk_size)
+        match = TOKEN_RE.match
+        buf = ''
+        base = 0        # global offset of buf[0]
+        pos = 0         # scan position inside buf
+        ln = 0
+        line_start = 0  # global offset of the current line
+        eof = False
+
+        while True:
+            m = match(buf, pos) if pos < len(buf) else None
+
+            # A lexeme that touches the end of the buffer may continue in
+            # the next chunk, so read more before committing to it
+            if not eof and (m.end() == len(buf) if m else pos >= len(buf)):
+                # The current line for an error snippet, but no more than SNIPPET_CHARS of it
+                keep = max(min(pos, line_start - base), pos - SNIPPET_CHARS, 0)
+                buf, base, pos = buf[keep:], base + keep, pos - keep
+                wanted = max(len(buf) - pos, chunk_size)
+                more = []
+                got = 0
+                for chunk in chunks:
+                    more.append(chunk)
+                    got += len(chunk)
+                    if got >= wanted: break
+                if not more:
+                    eof = True
+                buf += ''.join(more)
+                continue
+
+            if pos >= len(buf):
+                break
+
+            idx = base + pos
+            group = m.lastindex if m else None
+            if group == G_IDENTIFIER:
+                value = m.group()
+                first = value[0]
+                if first.isalpha() or first == '_':
+                    symbol = symbols.intern(value)
+                    value = symbols.names[symbol]  # one shared string per name
+                    type_ = TT_KEYWORD if symbol < KEYWORD_COUNT else TT_IDENTIFIER
+                else:
+                    group = None
+
+            if group is None:
+                snippet_start = max(line_start - base, pos - SNIPPET_CHARS, 0)
+                snippet_end = buf.find('\n', pos, pos + SNIPPET_CHARS)
+                snippet = buf[snippet_start:snippet_end if snippet_end >= 0 else pos + SNIPPET_CHARS]
+                rel = pos - snippet_start
+                # Counted from the snippet when it starts partway into the line
+                col = idx - line_start if snippet_start == line_start - base else rel
+                self.error = IllegalCharError(
+                    Position(rel, ln, col, fn, snippet),
+                    Position(rel + 1, ln, col + 1, fn, snippet),
+                    f"'{buf[pos]}'"
+                )
+                return
+
+            end = m.end()
+            if group == G_SKIP or group == G_COMMENT:
+                newlines = buf.count('\n', pos, end)
+                if newlines:
+                    ln += newlines
+                    line_start = base + buf.rfind('\n', pos, end) + 1
+                pos = end
+                continue
+
+            pos_start = Position(idx, ln, idx - line_start, fn, ftxt)
+            if group == G_OP:
+                type_ = OPERATORS[m.group()]
+                value = None
+            elif group == G_FLOAT:
+                type_, value = TT_FLOAT, float(m.group())
+            elif group == G_INT:
+                type_, value = TT_INT, int(m.group())
+            elif group == G_STRING:
+                type_ = TT_STRING
+                closed = end - pos > 1 and buf[end - 1] == '"'
+                value = buf[pos + 1:end - 1] if closed else buf[pos + 1:end]
+                newlines = value.count('\n')
+                if newlines:
+                    ln += newlines
+                    line_start = base + buf.rfind('\n', pos, end) + 1
+
+            tok = Token(type_, value)
+            tok.pos_start = pos_start
+            tok.pos_end = Position(base + end, ln, base + end - line_start, fn, ftxt)
+            yield tok
+            pos = end
+
+        idx = base + pos
+        tok = Token(TT_EOF)
+        tok.pos_start = Position(idx, ln, idx - line_start, fn, ftxt)
+        tok.pos_end = Position(idx + 1, ln, idx + 1 - line_start, fn, ftxt)
+        yield tok
+
+    def _chunks(self, chunk_size):
+        source = self.text
+        if isinstance(source, str):
+            yield source
+        elif hasattr(source, 'read'):
+            for chunk in iter(lambda: source.read(chunk_size), ''):
+                yield chunk
+        else:
+            for chunk in source:
+                if chunk:
+                    yield chunk
+
+#######################################
+# INCREMENTAL LEXING
+#######################################
+
+def relex(old, offset, deleted, inserted, budget=None):
+    """
+    Apply an edit (replace `deleted` characters at `offset` with `inserted`)
+    to the text behind the TokenStream old and re-lex only the damaged part.
+
+    Scanning restarts after the last token that ends before the edit and
+    stops as soon as a new token past the edit lines up with an old one,
+    since everything after that point lexes exactly as before. Returns
+    (stream, (first, old_stop, new_stop), error): new tokens [first:new_stop)
+    replace old tokens [first:old_stop). A budget is held to by the edited
+    text and the whole new stream, not just the part re-lexed, and raises
+    BudgetExceeded.
+    """
+    text = old.text[:offset] + inserted + old.text[offset + deleted:]
+    if budget is not None:
+        budget.check_source(old.fn, text)
+    delta = len(inserted) - deleted
+    edit_end = offset + len(inserted)
+    old_starts, old_ends, old_types = old.starts, old.ends, old.types
+    old_count = len(old) - 1  # not counting EOF
+
+    first = bisect_right(old_ends, offset - 1, 0, old_count)
+    restart = old_ends[first - 1] if first > 0 else 0
+
+    # New names go into a copy, the old stream may still be in use
+    symbols = old.symbols.copy()
+    fresh = TokenStream(old.fn, text, symbols)
+    cursor = [first]
+
+    def sync(type_id, start, end):
+        if start < edit_end:
+            return False
+        j = cursor[0]
+        old_start = start - delta
+        while j < old_count and old_starts[j] < old_start:
+            j += 1
+        cursor[0] = j
+        return (j < old_count and old_starts[j] == old_start
+                and old_ends[j] == end - delta and old_types[j] == type_id)
+
+    lexer = FastLexer(old.fn, text)
+    if budget is None:
+        idx, error = lexer.scan(fresh, restart, sync)
+    else:
+        idx, error = lexer.scan_checked(fresh, restart, budget=budget, sync=sync)
+    if error:
+        return None, None, error
+
+    if idx < len(text):
+        old_stop = cursor[0]
+    else:
+        old_stop = old_count + 1
+        fresh.append(ID_EOF, idx, idx + 1)
+
+    if old_starts.typecode != fresh.starts.typecode:
+        # The edit took the text across the 4 GB offset boundary
+        old_starts = array(fresh.starts.typecode, old_starts)
+        old_ends = array(fresh.ends.typecode, old_ends)
+
+    old_symbol_ids = old.symbol_ids
+    stream = TokenStream(old.fn, text, symbols)
+    stream.types = old_types[:first] + fresh.types + old_types[old_stop:]
+    stream.symbol_ids = old_symbol_ids[:first] + fresh.symbol_ids + old_symbol_ids[old_stop:]
+    stream.starts = old_starts[:first] + fresh.starts
+    stream.ends = old_ends[:first] + fresh.ends
+    if delta:
+        stream.starts.extend(start + delta for start in old_starts[old_stop:])
+        stream.ends.extend(end + delta for end in old_ends[old_stop:])
+    else:
+        stream.starts.extend(old_starts[old_stop:])
+        stream.ends.extend(old_ends[old_stop:])
+
+    if budget is not None and budget.max_tokens is not None and len(stream) - 1 > budget.max_tokens:
+        pos = stream.position(offset)
+        budget.exceeded('tokens', pos, pos)
+    return stream, (first, old_stop, first + len(fresh)), None
 
 #######################################
 # NODES & PARSE RESULT
 #######################################
 
 class NumberNode:
+    __slots__ = ('tok',)
     def __init__(self, tok):
         self.tok = tok
-        self.pos_start = tok.pos_start
-        self.pos_end = tok.pos_end
+    @property
+    def pos_start(self):
+        return self.tok.pos_start
+    @property
+    def pos_end(self):
+        return self.tok.pos_end
     def __repr__(self):
         return f'{self.tok.value}'
 
 class VarAccessNode:
+    __slots__ = ('var_name',)
     def __init__(self, var_name):
         self.var_name = var_name
-        self.pos_start = var_name.pos_start
-        self.pos_end = var_name.pos_end
+    @property
+    def pos_start(self):
+        return self.var_name.pos_start
+    @property
+    def pos_end(self):
+        return self.var_name.pos_end
     def __repr__(self):
         return f'{self.var_name.value}'
 
 class ListNode:
+    __slots__ = ('element_nodes', 'pos_start', 'pos_end')
     def __init__(self, element_nodes, pos_start, pos_end):
         self.element_nodes = element_nodes
         self.pos_start = pos_start
         self.pos_end = pos_end
     def __repr__(self):
-        return '[' + ', '.join(repr(el) for el in self.element_nodes) + ']'
+        return node_repr(self)
+
+class BinOpNode:
+    __slots__ = ('left_node', 'op_tok', 'right_node')
+    def __init__(self, left_node, op_tok, right_node):
+        self.left_node = left_node
+        self.op_tok = op_tok
+        self.right_node = right_node
+    @property
+    def pos_start(self):
+        return self.left_node.pos_start
+    @property
+    def pos_end(self):
+        return self.right_node.pos_end
+    def __repr__(self):
+        return node_repr(self)
+
+def node_repr(node):
+    """repr of an AST built without recursion, so deep nesting can be printed"""
+    parts = []
+    stack = [node]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, str):
+            parts.append(item)
+        elif isinstance(item, ListNode):
+            stack.append(']')
+            elements = item.element_nodes
+            for i in range(len(elements) - 1, -1, -1):
+                stack.append(elements[i])
+                if i:
+                    stack.append(', ')
+            stack.append('[')
+        elif isinstance(item, BinOpNode):
+            stack.extend((')', item.right_node, f', {item.op_tok.type}, ', item.left_node, '('))
+        else:
+            parts.append(repr(item))
+    return ''.join(parts)
 
 class ParseResult:
+    __slots__ = ('error', 'node')
     def __init__(self):
         self.error = None
         self.node = None
@@ -402,20 +1055,209 @@ class Parser:
 
         return ParseResult().success(ListNode(elements, pos_start, self.current_tok.pos_end))
 
+#######################################
+# ITERATIVE PARSER
+#######################################
+
+# Binary operator precedence for IterativeParser (higher binds tighter)
+BINARY_PRECEDENCE = {
+    TT_EQEQ: 1, TT_LT: 1, TT_LTE: 1, TT_GT: 1, TT_GTE: 1,
+    TT_PLUS: 2, TT_MINUS: 2,
+    TT_MUL: 3, TT_DIV: 3,
+}
+
+# Marks the start of a nested expression on the operator stack
+EXPR_MARK = None
+
+class IterativeParser:
+    """
+    Same grammar, AST and errors as Parser, but driven by explicit frame and
+    operator stacks instead of recursion, so nesting depth is only limited by
+    memory. Binary operators are parsed by precedence climbing over the given
+    precedence table; the default empty table keeps today's grammar, pass
+    BINARY_PRECEDENCE to accept PLUS/MUL/comparison expressions.
+
+    On a TokenStream it dispatches on the type column and only builds Token
+    objects for the atoms that end up in the AST. A budget's depth and clock
+    are checked while parsing (see Budget).
+    """
+    def __init__(self, tokens, operators=None, budget=None):
+        self.tokens = tokens
+        self.operators = operators or {}
+        self.budget = budget
+        if isinstance(tokens, TokenStream):
+            self.type_at = tokens.type_of
+            self.pos_start_at = lambda i: tokens.position(tokens.starts[i])
+            self.pos_end_at = lambda i: tokens.position(tokens.ends[i])
+        else:
+            self.type_at = lambda i: tokens[i].type
+            self.pos_start_at = lambda i: tokens[i].pos_start
+            self.pos_end_at = lambda i: tokens[i].pos_end
+        self.tok_idx = -1
+        self.advance()
+
+    def advance(self):
+        self.tok_idx += 1
+        if self.tok_idx < len(self.tokens):
+            self.current_idx = self.tok_idx
+            self.current_type = self.type_at(self.tok_idx)
+
+    @property
+    def current_tok(self):
+        return self.tokens[self.current_idx]
+
+    def parse(self):
+        precedence = self.operators
+        frames = []     # open '[' ([pos_start, elements]) and '(' (None) groups
+        operands = []
+        operators = []
+        budget = self.budget
+        max_depth = budget.max_depth if budget is not None else None
+        if max_depth is None:
+            max_depth = len(self.tokens)
+        # Token index at which the clock is next looked at, past the end if never
+        check_at = BUDGET_CHECK_TOKENS if budget is not None and budget.deadline is not None else len(self.tokens) + 1
+
+        while True:
+            if self.tok_idx >= check_at:
+                check_at += BUDGET_CHECK_TOKENS
+                if budget.out_of_time():
+                    self.exceeded('time')
+
+            # Expect an atom, opening groups until one is found
+            type_ = self.current_type
+            if type_ == TT_INT or type_ == TT_FLOAT:
+                node = NumberNode(self.current_tok)
+                self.advance()
+            elif type_ == TT_IDENTIFIER:
+                node = VarAccessNode(self.current_tok)
+                self.advance()
+            elif type_ == TT_LSQUARE:
+                pos_start = self.pos_start_at(self.current_idx)
+                self.advance()
+                if self.current_type == TT_RSQUARE:
+                    self.advance()
+                    node = ListNode([], pos_start, self.pos_end_at(self.current_idx))
+                else:
+                    if len(frames) >= max_depth:
+                        self.exceeded('depth')
+                    frames.append([pos_start, []])
+                    operators.append(EXPR_MARK)
+                    continue
+            elif type_ == TT_LPAREN:
+                if len(frames) >= max_depth:
+                    self.exceeded('depth')
+                self.advance()
+                frames.append(None)
+                operators.append(EXPR_MARK)
+                continue
+            else:
+                return self.failure("Expected number, identifier, '[' or '('")
+
+            # Have a complete operand: extend the expression or close groups
+            while True:
+                operands.append(node)
+                op_prec = precedence.get(self.current_type)
+                if op_prec is not None:
+                    self.reduce(operands, operators, op_prec)
+                    operators.append(self.current_tok)
+                    self.advance()
+                    break
+
+                self.reduce(operands, operators, 0)
+                node = operands.pop()
+                if not frames:
+                    if self.current_type != TT_EOF:
+                        return self.failure("Extra stuff after expression")
+                    result = ParseResult()
+                    result.node = node
+                    return result
+
+                operators.pop()  # EXPR_MARK of the innermost group
+                frame = frames[-1]
+                if frame is None:
+                    if self.current_type != TT_RPAREN:
+                        return self.failure("Expected ')'")
+                    self.advance()
+                    frames.pop()
+                    continue
+
+                frame[1].append(node)
+                if self.current_type == TT_COMMA:
+                    self.advance()
+                    operators.append(EXPR_MARK)
+                    break
+                if self.current_type != TT_RSQUARE:
+                    return self.failure("Expected ',' or ']'")
+                self.advance()
+                frames.pop()
+                node = ListNode(frame[1], frame[0], self.pos_end_at(self.current_idx))
+
+    def reduce(self, operands, operators, min_prec):
+        """Fold operators of precedence >= min_prec back to the innermost mark"""
+        precedence = self.operators
+        while operators and operators[-1] is not EXPR_MARK and precedence[operators[-1].type] >= min_prec:
+            op_tok = operators.pop()
+            right = operands.pop()
+            operands.append(BinOpNode(operands.pop(), op_tok, right))
+
+    def failure(self, details):
+        """Syntax error at the current token"""
+        i = self.current_idx
+        return ParseResult().failure(InvalidSyntaxError(self.pos_start_at(i), self.pos_end_at(i), details))
+
+    def exceeded(self, limit):
+        """Raise BudgetExceeded for limit at the current token"""
+        i = self.current_idx
+        self.budget.exceeded(limit, self.pos_start_at(i), self.pos_end_at(i))
+
 #######################################
 # RUN
 #######################################
 
-def run(fn, text):
-    lexer = Lexer(fn, text)
+def run_tokens(fn, text, lexer_class=FastLexer):
+    """Lex and parse once, returning the AST, the error and the token stream"""
+    lexer = lexer_class(fn, text)
     tokens, error = lexer.make_tokens()
     if error:
-        return None, error, 0
+        return None, error, tokens
 
-    parser = Parser(tokens)
+    parser = IterativeParser(tokens)
     ast = parser.parse()
 
-    return ast.node, ast.error, len(tokens) - 1  # -1 because of EOF token
+    return ast.node, ast.error, tokens
+
+def run_recovering(fn, text, max_errors=MAX_ERRORS, timings=None, cancelled=None, budget=None):
+    """
+    Lex past illegal characters and return (ast, errors, tokens): every lexer
+    error found (up to max_errors), or the parse error if lexing was clean.
+    If a timings dict is given, lex_ms and parse_ms are recorded in it. A
+    cancelled callback is checked while lexing and once more before parsing
+    (see FastLexer.make_tokens_recovering). A budget is checked by both the
+    lexer and the parser, which raise BudgetExceeded when it runs out.
+    """
+    start = time.perf_counter() if timings is not None else 0
+    tokens, errors = FastLexer(fn, text).make_tokens_recovering(max_errors, cancelled, budget)
+    if timings is not None:
+        timings['lex_ms'] = (time.perf_counter() - start) * 1000
+    if cancelled is not None and cancelled():
+        raise Cancelled()
+    return parse_lexed(tokens, errors, timings, budget)
+
+def parse_lexed(tokens, errors, timings=None, budget=None):
+    """The rest of run_recovering, for tokens and errors from another lexer"""
+    if errors:
+        return None, errors, tokens
+
+    start = time.perf_counter() if timings is not None else 0
+    ast = IterativeParser(tokens, budget=budget).parse()
+    if timings is not None:
+        timings['parse_ms'] = (time.perf_counter() - start) * 1000
+    return ast.node, [ast.error] if ast.error else [], tokens
+
+def run(fn, text, lexer_class=FastLexer):
+    result, error, tokens = run_tokens(fn, text, lexer_class)
+    return result, error, max(len(tokens) - 1, 0)  # -1 because of EOF token
 
 
 if __name__ == "__main__":
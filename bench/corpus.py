@@ -0,0 +1,92 @@
+# Synthetic source generator for the benchmarks
+#
+# Produces programs made of the tokens the lexer knows about: statements with
+# keywords, identifiers, numbers, strings, operators, comments and nested
+# [ ] / ( ) groups. Every knob is a plain keyword argument so runs are
+# reproducible from the parameters recorded in the results file.
+#
+# Usage: python bench/corpus.py SIZE_BYTES [seed] > program.txt
+import random
+import sys
+
+NAMES = ['marks', 'total', 'count', 'index', 'value', 'result', 'item', 'x', 'y', 'z']
+KEYWORDS = ['if', 'else', 'while', 'for', 'return', 'and', 'or', 'not', 'in', 'True', 'None']
+OPERATORS = ['+', '-', '*', '/', '=', '==', '<', '<=', '>', '>=', '++', '--', ':']
+WORDS = ['good', 'job', 'pass', 'fail', 'hello', 'world', 'lexer', 'token']
+
+def generate(size=1024 * 1024, identifier_density=0.5, string_length=12,
+             comment_rate=0.1, nesting=3, seed=0):
+    """
+    Return a program of roughly `size` characters.
+
+    identifier_density: share of operands that are identifiers/keywords
+        rather than numbers or strings
+    string_length: average number of characters in a string literal
+    comment_rate: probability that a line ends with a # comment
+    nesting: maximum depth of nested [ ] and ( ) groups
+    """
+    rng = random.Random(seed)
+    lines = []
+    total = 0
+    while total < size:
+        line = statement(rng, identifier_density, string_length, nesting)
+        if rng.random() < comment_rate:
+            line += '  # ' + ' '.join(rng.choice(WORDS) for _ in range(rng.randint(1, 6)))
+        lines.append(line)
+        total += len(line) + 1
+    return '\n'.join(lines) + '\n'
+
+def generate_expression(size=1024 * 1024, identifier_density=0.5, nesting=3, seed=0):
+    """A single list literal of roughly `size` characters that Parser accepts"""
+    rng = random.Random(seed)
+    elements = []
+    total = 2
+    while total < size:
+        element = list_literal(rng, identifier_density, nesting)
+        elements.append(element)
+        total += len(element) + 2
+    return '[' + ', '.join(elements) + ']'
+
+def statement(rng, identifier_density, string_length, nesting):
+    parts = [rng.choice(['VAR', rng.choice(KEYWORDS), name(rng)]), name(rng), '=']
+    for _ in range(rng.randint(1, 4)):
+        parts.append(operand(rng, identifier_density, string_length, nesting))
+        parts.append(rng.choice(OPERATORS))
+    parts.append(operand(rng, identifier_density, string_length, nesting))
+    return ' '.join(parts)
+
+def operand(rng, identifier_density, string_length, nesting):
+    roll = rng.random()
+    if nesting > 0 and roll < 0.2:
+        inner = operand(rng, identifier_density, string_length, nesting - 1)
+        if rng.random() < 0.5:
+            items = [inner] + [operand(rng, identifier_density, string_length, nesting - 1)
+                               for _ in range(rng.randint(0, 3))]
+            return '[' + ', '.join(items) + ']'
+        return '(' + inner + ')'
+    if rng.random() < identifier_density:
+        return name(rng) if rng.random() < 0.9 else rng.choice(KEYWORDS)
+    if rng.random() < 0.2:
+        length = max(0, int(rng.gauss(string_length, string_length / 3)))
+        return '"' + ''.join(rng.choice('abcdefghij klmnop') for _ in range(length)) + '"'
+    if rng.random() < 0.3:
+        return f'{rng.uniform(0, 1000):.2f}'
+    return str(rng.randint(0, 10000))
+
+def list_literal(rng, identifier_density, nesting):
+    if nesting <= 0 or rng.random() < 0.5:
+        if rng.random() < identifier_density:
+            return name(rng)
+        return str(rng.randint(0, 10000)) if rng.random() < 0.7 else f'{rng.uniform(0, 100):.2f}'
+    items = [list_literal(rng, identifier_density, nesting - 1) for _ in range(rng.randint(0, 4))]
+    literal = '[' + ', '.join(items) + ']'
+    return '(' + literal + ')' if rng.random() < 0.2 else literal
+
+def name(rng):
+    base = rng.choice(NAMES)
+    return base if rng.random() < 0.5 else f'{base}_{rng.randint(0, 99)}'
+
+if __name__ == '__main__':
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 1024 * 1024
+    seed = int(sys.argv[2]) if len(sys.argv) > 2 else 0
+    sys.stdout.write(generate(size, seed=seed))
@@ -0,0 +1,58 @@
+# Response size and time to first byte of the /execute formats
+#
+# Posts one generated program per format through the Flask test client with
+# the result cache disabled, and reports the body size (raw and gzipped),
+# the time until the first body chunk and the time until the last one.
+#
+# Usage: python bench/formats.py [--size BYTES] [--repeats N]
+import argparse
+import gzip
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import app
+from corpus import generate
+from result_cache import ResultCache
+
+FORMATS = ('json', 'stream', 'compact')
+
+def fetch(client, code, fmt):
+    """(body, seconds to first chunk, seconds to last chunk) of one request"""
+    start = time.perf_counter()
+    response = client.post(f'/execute?format={fmt}', json={'code': code}, buffered=False)
+    chunks = []
+    first = None
+    for chunk in response.response:
+        if first is None:
+            first = time.perf_counter() - start
+        chunks.append(chunk if isinstance(chunk, bytes) else chunk.encode('utf-8'))
+    response.close()
+    return b''.join(chunks), first, time.perf_counter() - start
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compare /execute response formats')
+    parser.add_argument('--size', type=int, default=1024 * 1024, help='program size in characters')
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    code = generate(args.size, seed=args.seed)
+    app.result_cache = ResultCache(max_entries=0)
+    client = app.app.test_client()
+
+    print(f'{len(code)} characters')
+    for fmt in FORMATS:
+        runs = [fetch(client, code, fmt) for _ in range(args.repeats)]
+        body = runs[0][0]
+        ttfb = sorted(run[1] for run in runs)[len(runs) // 2]
+        total = sorted(run[2] for run in runs)[len(runs) // 2]
+        print(f'{fmt:<8} {len(body) / 1024:9.0f} KB  gzip {len(gzip.compress(body)) / 1024:7.0f} KB  '
+              f'ttfb {ttfb * 1000:8.1f} ms  total {total * 1000:8.1f} ms')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,150 @@
+# Load generator for server.py (or app.py's dev server)
+#
+# Each client is a thread with its own keep-alive connection posting
+# generated programs to /execute back to back for --duration seconds. Every
+# request gets a unique trailing comment so the result cache never answers
+# it. A client that is refused with a 503 waits --backoff seconds before its
+# next request. Reports throughput, latency percentiles of the 200s and how
+# many requests were refused at each concurrency level.
+#
+# Without --url a server.py is started on a free port for the run.
+#
+# Usage: python bench/loadgen.py [--url http://127.0.0.1:8000] [--clients 1 8 64]
+import argparse
+import http.client
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from urllib.parse import urlsplit
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from corpus import generate
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+def client_loop(host, port, programs, deadline, backoff, results, lock, client_id):
+    connection = http.client.HTTPConnection(host, port, timeout=60)
+    latencies = []
+    statuses = {}
+    n = 0
+    while time.perf_counter() < deadline:
+        program = programs[n % len(programs)]
+        body = json.dumps({'code': f'{program}\n# client {client_id} request {n}'})
+        n += 1
+        start = time.perf_counter()
+        try:
+            connection.request('POST', '/execute', body, {'Content-Type': 'application/json'})
+            response = connection.getresponse()
+            response.read()
+            status = response.status
+        except (OSError, http.client.HTTPException):
+            connection.close()
+            connection = http.client.HTTPConnection(host, port, timeout=60)
+            status = 'error'
+        elapsed = time.perf_counter() - start
+        statuses[status] = statuses.get(status, 0) + 1
+        if status == 200:
+            latencies.append(elapsed)
+        elif status == 503:
+            time.sleep(backoff)
+    connection.close()
+    with lock:
+        results['latencies'].extend(latencies)
+        for status, count in statuses.items():
+            results['statuses'][status] = results['statuses'].get(status, 0) + count
+
+def run_level(host, port, programs, clients, duration, backoff):
+    results = {'latencies': [], 'statuses': {}}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+    threads = [threading.Thread(target=client_loop, args=(host, port, programs, deadline, backoff, results, lock, i))
+               for i in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    latencies = results['latencies']
+    report = {
+        'clients': clients,
+        'requests': sum(results['statuses'].values()),
+        'ok_per_s': len(latencies) / elapsed,
+        'statuses': {str(status): count for status, count in results['statuses'].items()}
+    }
+    if latencies:
+        report['p50_ms'] = percentile(latencies, 0.5) * 1000
+        report['p99_ms'] = percentile(latencies, 0.99) * 1000
+        report['max_ms'] = max(latencies) * 1000
+    return report
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def wait_for_port(host, port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection((host, port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f'server did not start on {host}:{port}')
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Drive /execute with concurrent clients')
+    parser.add_argument('--url', help='server to test (default: start server.py)')
+    parser.add_argument('--clients', type=int, nargs='*', default=[1, 8, 64])
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds per concurrency level')
+    parser.add_argument('--size', type=int, default=16 * 1024, help='program size in characters')
+    parser.add_argument('--backoff', type=float, default=0.1, help='seconds a client waits after a 503')
+    parser.add_argument('--programs', type=int, default=16, help='distinct programs to cycle through')
+    parser.add_argument('--server-args', default='', help='extra arguments for the started server.py')
+    parser.add_argument('--out', help='write the results to this JSON file')
+    args = parser.parse_args(argv)
+
+    programs = [generate(args.size, seed=seed) for seed in range(args.programs)]
+    server = None
+    if args.url:
+        parts = urlsplit(args.url)
+        host, port = parts.hostname, parts.port or 80
+    else:
+        host, port = '127.0.0.1', free_port()
+        server = subprocess.Popen([sys.executable, os.path.join(ROOT, 'server.py'), '--port', str(port)]
+                                  + args.server_args.split(), cwd=ROOT)
+        wait_for_port(host, port)
+
+    reports = []
+    try:
+        for clients in args.clients:
+            report = run_level(host, port, programs, clients, args.duration, args.backoff)
+            reports.append(report)
+            line = f"{clients:>3} clients  {report['ok_per_s']:8.1f} ok/s"
+            if 'p50_ms' in report:
+                line += f"  p50 {report['p50_ms']:8.1f} ms  p99 {report['p99_ms']:8.1f} ms"
+            line += f"  statuses {report['statuses']}"
+            print(line)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=30)
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump({'size': args.size, 'cpus': os.cpu_count(), 'levels': reports}, f, indent=2)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,198 @@
+# Benchmark suite for the lexer, parser, error rendering and the web path
+#
+# Each case is timed `repeats` times (p50/p99/mean latency, tokens/s, MB/s)
+# and run once more under tracemalloc for its peak memory. Results are
+# written as JSON; --compare flags cases that got slower (or hungrier) than
+# a saved baseline by more than --threshold and exits non-zero if any did.
+#
+# Usage:
+#   python bench/run.py --out baseline.json
+#   python bench/run.py --compare baseline.json [--threshold 0.1]
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import app
+from basic import Lexer, FastLexer, Parser, IterativeParser, ListNode, BinOpNode, IllegalCharError
+from corpus import generate, generate_expression
+from result_cache import ResultCache
+from strings_with_arrows import string_with_arrows
+
+# Metrics where a larger value is a regression
+LOWER_IS_BETTER = ('p50_ms', 'p99_ms', 'peak_kb')
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+def measure(func, repeats, size=0, tokens=0, nodes=0):
+    func()  # warm up
+    latencies = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        latencies.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    p50 = percentile(latencies, 0.5)
+    result = {
+        'p50_ms': p50 * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'mean_ms': sum(latencies) / len(latencies) * 1000,
+        'peak_kb': peak / 1024,
+        'bytes': size,
+        'tokens': tokens
+    }
+    if size:
+        result['mb_per_s'] = size / p50 / 1e6
+    if tokens:
+        result['tokens_per_s'] = tokens / p50
+    if nodes:
+        result['nodes_per_s'] = nodes / p50
+    return result
+
+def count_nodes(node):
+    count = 0
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        count += 1
+        if isinstance(node, ListNode):
+            stack.extend(node.element_nodes)
+        elif isinstance(node, BinOpNode):
+            stack.extend((node.left_node, node.right_node))
+    return count
+
+def error_positions(text, count):
+    """Evenly spread (pos_start, pos_end) pairs covering one character each"""
+    tokens, _ = FastLexer('<bench>', text).make_tokens()
+    step = max(len(text) // count, 1)
+    return [(tokens.position(idx), tokens.position(idx + 1))
+            for idx in range(0, len(text) - 1, step)][:count]
+
+def run_cases(args):
+    program = generate(args.size, args.identifier_density, args.string_length,
+                       args.comment_rate, args.nesting, args.seed)
+    expression = generate_expression(args.size, args.identifier_density, args.nesting, args.seed)
+    program_tokens, _ = FastLexer('<bench>', program).make_tokens()
+    expression_tokens, _ = FastLexer('<bench>', expression).make_tokens()
+    positions = error_positions(program, args.errors)
+
+    deep = '[' * args.depth + '1' + ']' * args.depth
+    deep_tokens, _ = FastLexer('<bench>', deep).make_tokens()
+    expression_nodes = count_nodes(IterativeParser(expression_tokens).parse().node)
+
+    cases = {
+        'lex.fast': (lambda: FastLexer('<bench>', program).make_tokens(),
+                     len(program), len(program_tokens), 0),
+        'parse': (lambda: IterativeParser(expression_tokens).parse(),
+                  len(expression), len(expression_tokens), expression_nodes),
+        'parse.recursive': (lambda: Parser(expression_tokens).parse(),
+                            len(expression), len(expression_tokens), expression_nodes),
+        'parse.deep': (lambda: IterativeParser(deep_tokens).parse(),
+                       len(deep), len(deep_tokens), args.depth + 1),
+        'string_with_arrows': (lambda: [string_with_arrows(program, start, end) for start, end in positions],
+                               0, 0, 0),
+        'error.as_string': (lambda: [IllegalCharError(start, end, "'?'").as_string() for start, end in positions],
+                            0, 0, 0),
+    }
+    if args.reference:
+        cases['lex.reference'] = (lambda: Lexer('<bench>', program).make_tokens(),
+                                  len(program), len(program_tokens), 0)
+
+    # The web path, without the result cache so every request does the work
+    app.result_cache = ResultCache(max_entries=0)
+    client = app.app.test_client()
+    cases['web.execute'] = (lambda: client.post('/execute', json={'code': expression}).get_data(),
+                            len(expression), len(expression_tokens), 0)
+    cases['web.execute_errors'] = (lambda: client.post('/execute', json={'code': program + ' @'}).get_data(),
+                                   len(program), len(program_tokens), 0)
+
+    results = {}
+    for name, (func, size, tokens, nodes) in cases.items():
+        if args.only and not any(name.startswith(prefix) for prefix in args.only):
+            continue
+        results[name] = measure(func, args.repeats, size, tokens, nodes)
+        print(format_result(name, results[name]))
+    return results
+
+def format_result(name, result):
+    line = f"{name:<22} p50 {result['p50_ms']:9.2f} ms  p99 {result['p99_ms']:9.2f} ms  peak {result['peak_kb']:9.0f} KB"
+    if 'mb_per_s' in result:
+        line += f"  {result['mb_per_s']:6.2f} MB/s"
+    if 'tokens_per_s' in result:
+        line += f"  {result['tokens_per_s']:10.0f} tokens/s"
+    if 'nodes_per_s' in result:
+        line += f"  {result['nodes_per_s']:10.0f} nodes/s"
+    return line
+
+def compare(results, baseline, threshold):
+    """Return the (case, metric, old, new) tuples that regressed by more than threshold"""
+    regressions = []
+    for name, result in results.items():
+        old = baseline.get('results', {}).get(name)
+        if old is None:
+            continue
+        for metric in LOWER_IS_BETTER:
+            if metric in old and old[metric] > 0 and result[metric] > old[metric] * (1 + threshold):
+                regressions.append((name, metric, old[metric], result[metric]))
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Lexical Analyzer benchmarks')
+    parser.add_argument('--size', type=int, default=256 * 1024, help='corpus size in characters')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--identifier-density', type=float, default=0.5)
+    parser.add_argument('--string-length', type=int, default=12)
+    parser.add_argument('--comment-rate', type=float, default=0.1)
+    parser.add_argument('--nesting', type=int, default=3)
+    parser.add_argument('--depth', type=int, default=10000, help='nesting depth of the parse.deep case')
+    parser.add_argument('--repeats', type=int, default=10)
+    parser.add_argument('--errors', type=int, default=200, help='diagnostics rendered per error case')
+    parser.add_argument('--reference', action='store_true', help='also time the reference Lexer')
+    parser.add_argument('--only', nargs='*', help='only run cases starting with these prefixes')
+    parser.add_argument('--out', help='write results to this JSON file')
+    parser.add_argument('--compare', help='baseline JSON file to check for regressions')
+    parser.add_argument('--threshold', type=float, default=0.10, help='allowed slowdown, e.g. 0.1 = 10%%')
+    args = parser.parse_args(argv)
+
+    results = run_cases(args)
+    report = {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'params': {
+            'size': args.size, 'seed': args.seed, 'repeats': args.repeats, 'errors': args.errors,
+            'identifier_density': args.identifier_density, 'string_length': args.string_length,
+            'comment_rate': args.comment_rate, 'nesting': args.nesting, 'depth': args.depth
+        },
+        'results': results
+    }
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        for name, metric, old, new in regressions:
+            print(f'REGRESSION {name} {metric}: {old:.2f} -> {new:.2f} ({(new / old - 1) * 100:+.0f}%)')
+        if regressions:
+            return 1
+        print('no regressions')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
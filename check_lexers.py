@@ -0,0 +1,140 @@
+# Check that FastLexer produces exactly the same tokens as the reference Lexer,
+# both from a whole string and streamed through iter_tokens in random chunks,
+# that relex after a random edit matches lexing the edited text from scratch,
+# that lexing in cancellable slices changes nothing, and that lex_file on a
+# file matches lexing what open().read() returns
+#
+# Usage: python check_lexers.py [file ...]   (defaults to files/test.txt plus random programs)
+import os
+import random
+import sys
+import tempfile
+from collections import Counter
+
+import basic
+from basic import Lexer, FastLexer, relex
+from mapped_lexer import lex_file
+
+ALPHABET = 'abcXYZ_019.  \t\n\n"#,=<>+-*/()[]:é' * 20 + '²!\r'
+
+def describe(tok):
+    return (tok.type, tok.value,
+            tok.pos_start.idx, tok.pos_start.ln, tok.pos_start.col,
+            tok.pos_end.idx, tok.pos_end.ln, tok.pos_end.col)
+
+def describe_error(error):
+    if error is None:
+        return None
+    return (error.error_name, error.details,
+            error.pos_start.idx, error.pos_start.ln, error.pos_start.col,
+            error.pos_end.idx, error.pos_end.ln, error.pos_end.col)
+
+def compare(fn, text):
+    ref_tokens, ref_error = Lexer(fn, text).make_tokens()
+    fast_tokens, fast_error = FastLexer(fn, text).make_tokens()
+    if describe_error(ref_error) != describe_error(fast_error):
+        return f'{fn}: errors differ: {describe_error(ref_error)} != {describe_error(fast_error)}'
+    if len(ref_tokens) != len(fast_tokens):
+        return f'{fn}: token counts differ: {len(ref_tokens)} != {len(fast_tokens)}'
+    for ref, fast in zip(ref_tokens, fast_tokens):
+        if describe(ref) != describe(fast):
+            return f'{fn}: tokens differ: {describe(ref)} != {describe(fast)}'
+    names = Counter(tok.value for tok in ref_tokens if tok.type in ('IDENTIFIER', 'KEYWORD'))
+    if fast_tokens and names != fast_tokens.occurrences():
+        return f'{fn}: symbol counts differ: {dict(names)} != {fast_tokens.occurrences()}'
+    return None
+
+def compare_streamed(fn, text, rng):
+    ref_tokens, ref_error = Lexer(fn, text).make_tokens()
+    cuts = sorted(rng.randint(0, len(text)) for _ in range(rng.randint(0, 6)))
+    chunks = [text[i:j] for i, j in zip([0] + cuts, cuts + [len(text)])]
+    lexer = FastLexer(fn, chunks)
+    streamed = list(lexer.iter_tokens(chunk_size=rng.randint(1, 8)))
+    if ref_error or lexer.error:
+        ref = ref_error and describe_error(ref_error)[:2] + describe_error(ref_error)[3:5]
+        got = lexer.error and describe_error(lexer.error)[:2] + describe_error(lexer.error)[3:5]
+        if ref != got:
+            return f'{fn} (streamed): errors differ: {ref} != {got}'
+        return None
+    if [describe(t) for t in ref_tokens] != [describe(t) for t in streamed]:
+        return f'{fn} (streamed): tokens differ for chunks {chunks!r}'
+    return None
+
+def compare_relexed(fn, text, rng):
+    old, error = FastLexer(fn, text).make_tokens()
+    if error:
+        return None
+    offset = rng.randint(0, len(text))
+    deleted = rng.randint(0, len(text) - offset)
+    inserted = random_program(rng, rng.randint(0, 4))
+    edited = text[:offset] + inserted + text[offset + deleted:]
+    expected, expected_error = FastLexer(fn, edited).make_tokens()
+    stream, changed, error = relex(old, offset, deleted, inserted)
+    if describe_error(expected_error) != describe_error(error):
+        return f'{fn} (relexed): errors differ for {edited!r}'
+    if error:
+        return None
+    columns = lambda s: (list(s.types), list(s.starts), list(s.ends))
+    if columns(expected) != columns(stream):
+        return f'{fn} (relexed): tokens differ for edit {offset}, {deleted}, {inserted!r} of {text!r}'
+    values = lambda s: [s.value_of(i) for i in range(len(s))]
+    if values(expected) != values(stream) or expected.occurrences() != stream.occurrences():
+        return f'{fn} (relexed): symbols differ for edit {offset}, {deleted}, {inserted!r} of {text!r}'
+    first, old_stop, new_stop = changed
+    if list(stream.types[:first]) != list(old.types[:first]) or len(stream) - new_stop != len(old) - old_stop:
+        return f'{fn} (relexed): bad changed range {changed}'
+    return None
+
+def compare_mapped(fn, text, directory):
+    path = os.path.join(directory, 'program.txt')
+    with open(path, 'wb') as f:
+        f.write(text.encode('utf-8'))
+    with open(path, 'r', encoding='utf-8') as f:
+        read = f.read()
+    expected, expected_errors = FastLexer(fn, read).make_tokens_recovering()
+    tokens, errors = lex_file(fn, path)
+    if [e.as_string() for e in expected_errors] != [e.as_string() for e in errors]:
+        return f'{fn} (mapped): errors differ for {text!r}'
+    if [describe(t) for t in expected] != [describe(t) for t in tokens]:
+        return f'{fn} (mapped): tokens differ for {text!r}'
+    return None
+
+def compare_checked(fn, text, rng):
+    expected, expected_errors = FastLexer(fn, text).make_tokens_recovering()
+    basic.CANCEL_CHECK_CHARS = rng.randint(1, 8)
+    tokens, errors = FastLexer(fn, text).make_tokens_recovering(cancelled=lambda: False)
+    if [e.as_string() for e in expected_errors] != [e.as_string() for e in errors]:
+        return f'{fn} (checked): errors differ for {text!r}'
+    if [describe(t) for t in expected] != [describe(t) for t in tokens]:
+        return f'{fn} (checked): tokens differ for {text!r}'
+    return None
+
+def random_program(rng, length):
+    return ''.join(rng.choice(ALPHABET) for _ in range(length))
+
+if __name__ == '__main__':
+    failures = []
+    if len(sys.argv) > 1:
+        for path in sys.argv[1:]:
+            with open(path, 'r') as f:
+                failures.append(compare(path, f.read()))
+    else:
+        with open('files/test.txt', 'r') as f:
+            failures.append(compare('files/test.txt', f.read()))
+        rng = random.Random(0)
+        with tempfile.TemporaryDirectory() as directory:
+            for i in range(5000):
+                text = random_program(rng, rng.randint(0, 60))
+                failures.append(compare(f'<random {i}>', text))
+                failures.append(compare_streamed(f'<random {i}>', text, rng))
+                failures.append(compare_relexed(f'<random {i}>', text, rng))
+                failures.append(compare_checked(f'<random {i}>', text, rng))
+                # Mostly ASCII, so the mapped path is the one exercised
+                ascii_text = text.encode('ascii', 'ignore').decode('ascii') if i % 4 else text
+                failures.append(compare_mapped(f'<random {i}>', ascii_text, directory))
+
+    failures = [f for f in failures if f]
+    for failure in failures:
+        print(failure)
+    print(f'{len(failures)} mismatch(es)')
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,69 @@
+# Check that IterativeParser builds the same AST and errors as the recursive Parser,
+# and that each Budget limit stops lexing or parsing with its own error
+#
+# Usage: python check_parsers.py [count]
+import random
+import sys
+
+from basic import FastLexer, Parser, IterativeParser, Budget, BudgetExceeded, run_recovering
+
+PIECES = ['1', '2.5', 'x', 'y', '[', ']', '(', ')', ',', ',', '[', ']', '+', '"s"', 'if', ' ']
+
+def outcome(parser):
+    res = parser.parse()
+    if res.error:
+        error = res.error
+        return ('error', error.details, error.pos_start.idx, error.pos_end.idx)
+    node = res.node
+    return ('ok', repr(node), node.pos_start.idx, node.pos_end.idx)
+
+def compare(text):
+    tokens, error = FastLexer('<check>', text).make_tokens()
+    if error:
+        return None
+    expected = outcome(Parser(tokens))
+    got = outcome(IterativeParser(tokens))
+    if expected != got:
+        return f'{text!r}: {expected} != {got}'
+    return None
+
+# (limit, budget with only that limit set, source over it)
+BUDGET_CASES = [
+    ('bytes', Budget(max_bytes=10), 'x' * 11),
+    ('bytes', Budget(max_bytes=10), '\u00e9' * 6),
+    ('tokens', Budget(max_tokens=3), 'a b c d'),
+    ('depth', Budget(max_depth=2), '[[(1)]]'),
+    ('time', Budget(seconds=0), '1'),
+]
+
+def check_budgets():
+    failures = []
+    for limit, budget, text in BUDGET_CASES:
+        try:
+            run_recovering('<check>', text, budget=budget)
+        except BudgetExceeded as e:
+            if e.error.limit != limit:
+                failures.append(f'{text!r}: stopped by {e.error.limit}, expected {limit}')
+            e.error.as_string()
+        except Exception as e:
+            failures.append(f'{text!r}: {limit} limit raised {e!r}')
+        else:
+            failures.append(f'{text!r}: {limit} limit not enforced')
+    # Within every limit
+    run_recovering('<check>', '[[1]]', budget=Budget(10, 10, 2, None))
+    return failures
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    rng = random.Random(0)
+    failures = []
+    for _ in range(count):
+        text = ' '.join(rng.choice(PIECES) for _ in range(rng.randint(0, 14)))
+        failures.append(compare(text))
+    failures.extend(check_budgets())
+
+    failures = [f for f in failures if f]
+    for failure in failures[:20]:
+        print(failure)
+    print(f'{len(failures)} mismatch(es)')
+    sys.exit(1 if failures else 0)
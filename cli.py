@@ -0,0 +1,274 @@
+# Lex and parse every file under a directory, offline, on all cores
+#
+# Files are handed to a process pool; each worker lexes one file (from a
+# memory map where possible, see mapped_lexer.py), parses it and serializes
+# its record, and the parent appends the records to a JSONL file in the
+# order they finish. Each record holds the file's path relative to the root,
+# its sha256, the parse result and any lexer errors, plus either the
+# token_list/token_values lists (--format json) or the compact columns
+# (--format compact) the web app returns.
+#
+# Progress is checkpointed in a manifest next to the output, one line per
+# finished file with its size, mtime, content hash and --format, written
+# after the file's record. A rerun, interrupted or not, skips every file
+# whose size and mtime, or failing that whose content hash, match the
+# manifest, and appends records only for new and changed files, so for any
+# path the last record in the output is the current one. A file recorded in
+# another --format counts as changed. --fresh starts both files over.
+#
+# Usage: python cli.py DIR [-o tokens.jsonl] [--format compact] [--workers N] [--glob '*.txt']
+import argparse
+import fnmatch
+import hashlib
+import json
+import os
+import signal
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from basic import parse_lexed, IllegalCharError, MAX_ERRORS
+from mapped_lexer import map_file, lex_file
+from token_formats import serialize_tokens, compact_result
+
+FORMATS = ('json', 'compact')
+# Files queued per worker, so a huge tree is never submitted all at once
+QUEUED_PER_WORKER = 4
+SLOWEST_SHOWN = 10
+
+def walk(root, pattern, exclude=()):
+    """
+    Paths of the files under root matching pattern, relative to root, in a
+    stable order, leaving out the absolute paths in exclude
+    """
+    for dirpath, dirnames, filenames in os.walk(root):
+        # Hidden directories (.git and the like) are not source trees
+        dirnames[:] = sorted(name for name in dirnames if not name.startswith('.'))
+        for name in sorted(filenames):
+            path = os.path.join(dirpath, name)
+            if fnmatch.fnmatch(name, pattern) and os.path.abspath(path) not in exclude:
+                yield os.path.relpath(path, root)
+
+def file_hash(path):
+    data = map_file(path)
+    try:
+        return hashlib.sha256(data).hexdigest()
+    finally:
+        if not isinstance(data, bytes):
+            data.close()
+
+def process_file(root, name, fmt, known_hash):
+    """
+    Worker: lex and parse one file. Returns (entry, line, success, stats)
+    where entry is its manifest entry (None if it could not be read), line
+    its JSONL record (None if its content matches known_hash) and stats the
+    (bytes, tokens, seconds) spent on it.
+    """
+    path = os.path.join(root, name)
+    start = time.perf_counter()
+    try:
+        stat = os.stat(path)
+        digest = file_hash(path)
+    except OSError as e:
+        record = {'path': name, 'success': False, 'error': f'Error reading file: {e}'}
+        return None, json.dumps(record), False, (0, 0, time.perf_counter() - start)
+
+    entry = {'path': name, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': digest, 'format': fmt}
+    if digest == known_hash:
+        return entry, None, True, (0, 0, time.perf_counter() - start)
+
+    record = {'path': name, 'sha256': digest}
+    try:
+        tokens, errors = lex_file(name, path, MAX_ERRORS)
+    except (OSError, ValueError) as e:
+        # Not UTF-8, or gone since it was hashed
+        record.update({'success': False, 'error': f'Error reading file: {e}'})
+        return entry, json.dumps(record), False, (stat.st_size, 0, time.perf_counter() - start)
+
+    result, errors, tokens = parse_lexed(tokens, errors)
+    token_count = max(len(tokens) - 1, 0)  # -1 because of EOF token
+    record['success'] = True
+    record['tokens'] = token_count
+    record['result'] = str(result) if result is not None else ""
+    lexer_errors = [error.as_string() for error in errors if isinstance(error, IllegalCharError)]
+    if lexer_errors:
+        record['success'] = False
+        record['errors'] = lexer_errors
+    if fmt == 'compact':
+        record = compact_result(record, tokens)
+    else:
+        record['token_list'], record['token_values'] = serialize_tokens(tokens)
+    line = json.dumps(record, separators=(',', ':'))
+    return entry, line, record['success'], (stat.st_size, token_count, time.perf_counter() - start)
+
+def load_manifest(path):
+    """{name: entry} from a manifest, the last entry for a name winning"""
+    manifest = {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # cut short by an interrupted run
+                manifest[entry['path']] = entry
+    except FileNotFoundError:
+        pass
+    return manifest
+
+def open_log(path, fresh):
+    """Open path for appending, dropping a last line left unfinished by an interrupted run"""
+    if fresh and os.path.exists(path):
+        os.remove(path)
+    f = open(path, 'a+b')
+    end = f.seek(0, os.SEEK_END)
+    if end:
+        f.seek(max(end - 1, 0))
+        if f.read(1) != b'\n':
+            # Find the start of the unfinished line, reading back a block at a time
+            pos = end
+            while pos > 0:
+                block_start = max(pos - 65536, 0)
+                f.seek(block_start)
+                newline = f.read(pos - block_start).rfind(b'\n')
+                if newline >= 0:
+                    pos = block_start + newline + 1
+                    break
+                pos = block_start
+            f.truncate(pos)
+    return f
+
+def unchanged(root, name, entry):
+    """Whether the file still has the size and mtime recorded in its manifest entry"""
+    try:
+        stat = os.stat(os.path.join(root, name))
+    except OSError:
+        return False
+    return stat.st_size == entry['size'] and stat.st_mtime_ns == entry['mtime_ns']
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+def report(per_file, skipped, failed, elapsed, out=sys.stderr):
+    """Aggregate throughput, the per-file spread and the slowest files"""
+    total_bytes = sum(size for name, size, tokens, seconds in per_file)
+    total_tokens = sum(tokens for name, size, tokens, seconds in per_file)
+    print(f'{len(per_file)} file(s) lexed, {skipped} unchanged, {failed} failed in {elapsed:.2f}s', file=out)
+    if not per_file or not elapsed:
+        return
+    print(f'aggregate: {total_bytes / elapsed / 1e6:.2f} MB/s, {total_tokens / elapsed:,.0f} tokens/s', file=out)
+    rates = [size / seconds / 1e6 for name, size, tokens, seconds in per_file if seconds]
+    if rates:
+        print(f'per file: p50 {percentile(rates, 0.5):.2f} MB/s, p1 {percentile(rates, 0.01):.2f} MB/s, '
+              f'p99 {percentile(rates, 0.99):.2f} MB/s', file=out)
+    print('slowest files:', file=out)
+    for name, size, tokens, seconds in sorted(per_file, key=lambda item: -item[3])[:SLOWEST_SHOWN]:
+        rate = size / seconds / 1e6 if seconds else 0
+        print(f'  {seconds * 1000:9.1f} ms  {size / 1e6:8.2f} MB  {tokens:10d} tokens  {rate:7.2f} MB/s  {name}', file=out)
+
+def ignore_interrupts():
+    """Worker initializer: a Ctrl+C reaches the whole process group, but only the parent stops"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+def run(root, output, manifest_path, fmt='json', workers=None, pattern='*', fresh=False, verbose=False):
+    """
+    Lex the tree under root into output; returns the number of files that
+    failed. On SIGINT or SIGTERM no more files are started, the ones in
+    flight are finished and recorded, and KeyboardInterrupt is raised.
+    """
+    workers = workers or os.cpu_count() or 1
+    manifest = {} if fresh else load_manifest(manifest_path)
+    out = open_log(output, fresh)
+    log = open_log(manifest_path, fresh)
+
+    stopping = []
+    def stop(signum, frame):
+        stopping.append(signum)
+    handlers = {signum: signal.signal(signum, stop) for signum in (signal.SIGINT, signal.SIGTERM)}
+
+    per_file = []
+    skipped = failed = 0
+    start = time.perf_counter()
+    # The output may well be inside the tree; it is not a source file
+    names = walk(root, pattern, {os.path.abspath(output), os.path.abspath(manifest_path)})
+    pending = {}  # future -> file name
+    executor = ProcessPoolExecutor(max_workers=workers, initializer=ignore_interrupts)
+    try:
+        while True:
+            while not stopping and len(pending) < workers * QUEUED_PER_WORKER:
+                name = next(names, None)
+                if name is None:
+                    break
+                entry = manifest.get(name)
+                if entry is not None and entry.get('format') != fmt:
+                    # Its last record is in another format: write it again
+                    entry = None
+                if entry is not None and unchanged(root, name, entry):
+                    skipped += 1
+                    continue
+                known_hash = entry['sha256'] if entry is not None else None
+                pending[executor.submit(process_file, root, name, fmt, known_hash)] = name
+            if not pending:
+                break
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = pending.pop(future)
+                try:
+                    entry, line, success, (size, tokens, seconds) = future.result()
+                except Exception as e:
+                    # Left out of the manifest, so the next run tries it again
+                    record = {'path': name, 'success': False, 'error': f'Error processing file: {e!r}'}
+                    entry, line, success, (size, tokens, seconds) = None, json.dumps(record), False, (0, 0, 0)
+                if line is None:
+                    skipped += 1
+                else:
+                    # The record goes first: a file is only done once it is in the output
+                    out.write(line.encode('utf-8') + b'\n')
+                    out.flush()
+                    if not success:
+                        failed += 1
+                    if size:
+                        per_file.append((name, size, tokens, seconds))
+                    if verbose:
+                        print(f'{name}: {tokens} tokens in {seconds * 1000:.1f} ms', file=sys.stderr)
+                if entry is not None:
+                    log.write(json.dumps(entry).encode('utf-8') + b'\n')
+                    log.flush()
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+        for signum, handler in handlers.items():
+            signal.signal(signum, handler)
+        out.close()
+        log.close()
+        report(per_file, skipped, failed, time.perf_counter() - start)
+    if stopping:
+        print('interrupted, rerun to resume', file=sys.stderr)
+        raise KeyboardInterrupt
+    return failed
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Lex and parse every file under a directory to JSONL')
+    parser.add_argument('root', help='directory to walk')
+    parser.add_argument('-o', '--output', default='tokens.jsonl', help='JSONL file the records are appended to')
+    parser.add_argument('--manifest', help='checkpoint manifest (default: OUTPUT.manifest)')
+    parser.add_argument('--format', choices=FORMATS, default='json', help='token lists or compact columns')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes (default: one per CPU)')
+    parser.add_argument('--glob', default='*', help='only lex file names matching this pattern')
+    parser.add_argument('--fresh', action='store_true', help='ignore the manifest and start the output over')
+    parser.add_argument('-v', '--verbose', action='store_true', help='print each file as it finishes')
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.root):
+        parser.error(f'{args.root} is not a directory')
+    manifest = args.manifest or args.output + '.manifest'
+    try:
+        failed = run(args.root, args.output, manifest, args.format, args.workers, args.glob,
+                     args.fresh, args.verbose)
+    except KeyboardInterrupt:
+        return 130
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,388 @@
+# Evaluate the expressions the parser builds
+#
+# Rather than walking the AST on every run, an AST is compiled once into
+# nested Python closures: every node becomes a function of the variable slot
+# list, with the function implementing its operator bound at compile time,
+# and every variable is resolved to its index in that list. Subtrees without
+# variables are folded to their value, and a left-leaning chain of binary
+# operators (a + b - c * d ...) becomes one closure looping over its steps,
+# so long sums neither nest calls nor hit the recursion limit.
+#
+# Values are numbers and lists. + adds numbers or joins lists, - * / work on
+# numbers, the comparisons give 1 or 0. Expressions are parsed with
+# BINARY_PRECEDENCE, so operators are accepted here even though /execute's
+# parse result does not.
+#
+# No list grows past MAX_LIST_ITEMS, and a chain joining lists extends the
+# one it built in place instead of copying it at every step, so list work
+# stays linear in the size of the result; constant folding does the same.
+# No integer grows past MAX_INT_BITS, so every result can be written out as
+# JSON, and a result nesting lists deeper than MAX_VALUE_DEPTH is an error.
+# Compiling and running can be given a Budget, whose clock is checked along
+# operator chains, every BUDGET_CHECK_STEPS nodes compiled and whenever lists
+# are joined.
+#
+# Usage: python evaluator.py EXPR [NAME=VALUE ...]   (values as JSON)
+import json
+import operator
+import sys
+import threading
+
+from basic import (FastLexer, IterativeParser, NumberNode, VarAccessNode, ListNode, BinOpNode,
+                   RTError, BINARY_PRECEDENCE, TOKEN_SYMBOLS,
+                   TT_PLUS, TT_MINUS, TT_MUL, TT_DIV, TT_EQEQ, TT_LT, TT_LTE, TT_GT, TT_GTE)
+
+MAX_LIST_ITEMS = 100000
+# About 4200 decimal digits: below the 4300 that int -> str (and so JSON) allows
+MAX_INT_BITS = 14000
+# Below the recursion limit the JSON encoder runs into
+MAX_VALUE_DEPTH = 500
+# Steps of an operator chain between two looks at the budget's clock
+BUDGET_CHECK_STEPS = 1024
+
+# .budget: the Budget of the run in progress on this thread, if any
+running = threading.local()
+
+class ListTooLong(Exception):
+    """An operation would build a list of more than MAX_LIST_ITEMS"""
+
+class OutOfTime(Exception):
+    """The running program's budget ran out; Program.run reports it"""
+
+def check_join(length):
+    """Before joining lists into one of length items"""
+    if length > MAX_LIST_ITEMS:
+        raise ListTooLong()
+    budget = getattr(running, 'budget', None)
+    if budget is not None and budget.out_of_time():
+        raise OutOfTime()
+
+def check_int(value):
+    """value, unless it is an integer past MAX_INT_BITS"""
+    if type(value) is int and value.bit_length() > MAX_INT_BITS:
+        raise OverflowError()
+    return value
+
+def add(a, b):
+    if type(a) is list and type(b) is list:
+        check_join(len(a) + len(b))
+        return a + b
+    return check_int(a + b)
+
+def sub(a, b):
+    return check_int(a - b)
+
+def mul(a, b):
+    if type(a) is list or type(b) is list:
+        # No list repetition: [0] * 1000000000 would be one huge allocation
+        raise TypeError()
+    return check_int(a * b)
+
+def equal(a, b):
+    return 1 if a == b else 0
+
+def less(a, b):
+    return 1 if a < b else 0
+
+def less_equal(a, b):
+    return 1 if a <= b else 0
+
+def greater(a, b):
+    return 1 if a > b else 0
+
+def greater_equal(a, b):
+    return 1 if a >= b else 0
+
+OPERATIONS = {
+    TT_PLUS: add,
+    TT_MINUS: sub,
+    TT_MUL: mul,
+    TT_DIV: operator.truediv,
+    TT_EQEQ: equal,
+    TT_LT: less,
+    TT_LTE: less_equal,
+    TT_GT: greater,
+    TT_GTE: greater_equal,
+}
+
+# What a failing operation raises
+OPERATION_ERRORS = (TypeError, ArithmeticError, ListTooLong)
+
+class EvalError(Exception):
+    """Carries the RTError of a failed run out of the closures"""
+    def __init__(self, error):
+        self.error = error
+
+def type_name(value):
+    return 'list' if isinstance(value, list) else 'number'
+
+def operation_error(node, a, b, exception):
+    if isinstance(exception, ZeroDivisionError):
+        details = 'Division by zero'
+    elif isinstance(exception, ArithmeticError):
+        details = 'Number too large'
+    elif isinstance(exception, ListTooLong):
+        details = f'List longer than {MAX_LIST_ITEMS} items'
+    else:
+        details = f'Illegal operation: {type_name(a)} {TOKEN_SYMBOLS[node.op_tok.type]} {type_name(b)}'
+    return EvalError(RTError(*span(node), details))
+
+def span(node):
+    """(pos_start, pos_end) of node, found without recursing down a long operator chain"""
+    first = last = node
+    while isinstance(first, BinOpNode):
+        first = first.left_node
+    while isinstance(last, BinOpNode):
+        last = last.right_node
+    return first.pos_start, last.pos_end
+
+def is_value(value):
+    """
+    Whether value (from JSON, say) is a number or a list of values, with
+    integers and nesting within MAX_INT_BITS and MAX_VALUE_DEPTH
+    """
+    stack = [(value, 0)]
+    while stack:
+        value, depth = stack.pop()
+        if isinstance(value, list):
+            if depth >= MAX_VALUE_DEPTH:
+                return False
+            stack.extend((item, depth + 1) for item in value)
+        elif isinstance(value, bool) or not isinstance(value, (int, float)):
+            return False
+        elif isinstance(value, int) and value.bit_length() > MAX_INT_BITS:
+            return False
+    return True
+
+def too_deep(value):
+    """Whether lists nest more than MAX_VALUE_DEPTH deep in value"""
+    stack = [(value, 0)] if type(value) is list else []
+    while stack:
+        value, depth = stack.pop()
+        if depth >= MAX_VALUE_DEPTH:
+            return True
+        stack.extend((item, depth + 1) for item in value if type(item) is list)
+    return False
+
+class Program:
+    """A compiled expression, run with values for its variables"""
+    __slots__ = ('code', 'value', 'names', 'uses', 'size', 'pos_start', 'pos_end')
+    def __init__(self, code, value, names, uses, size, pos_start, pos_end):
+        self.code = code    # slots -> value, or None if the expression is constant
+        self.value = value  # the constant
+        self.names = names  # variable name per slot
+        self.uses = uses    # first VarAccessNode per slot, for errors
+        self.size = size    # nodes compiled
+        self.pos_start = pos_start
+        self.pos_end = pos_end
+
+    def run(self, variables=None, budget=None):
+        """
+        (value, error) of the expression, given a {name: value} dict. Raises
+        BudgetExceeded if a budget is given and its time runs out.
+        """
+        variables = variables or {}
+        slots = []
+        for name, node in zip(self.names, self.uses):
+            if name not in variables:
+                return None, RTError(node.pos_start, node.pos_end, f"'{name}' is not defined")
+            slots.append(variables[name])
+        if self.code is None:
+            value = self.value
+        else:
+            running.budget = budget
+            try:
+                value = self.code(slots)
+            except EvalError as e:
+                return None, e.error
+            except RecursionError:
+                # Only nested lists with variables still nest calls this deep
+                return None, RTError(self.pos_start, self.pos_end, 'Expression nested too deeply to evaluate')
+            except OutOfTime:
+                budget.exceeded('time', self.pos_start, self.pos_end)
+            finally:
+                running.budget = None
+        if too_deep(value):
+            return None, RTError(self.pos_start, self.pos_end, f'Value nested more than {MAX_VALUE_DEPTH} lists deep')
+        return value, None
+
+def constant(value):
+    return lambda slots: value
+
+def compile_ast(root, budget=None):
+    """
+    Compile an AST into a Program. Nodes are visited with an explicit
+    stack, so the depth of the AST is not limited by recursion here. Raises
+    BudgetExceeded if a budget is given and its time runs out.
+    """
+    slot_of = {}  # variable name -> slot index
+    uses = []
+    compiled = {}  # id(node) -> (code, value), code None for a constant value
+    size = 0
+    left_until_check = BUDGET_CHECK_STEPS
+    stack = [(root, False)]
+    while stack:
+        left_until_check -= 1
+        if not left_until_check:
+            left_until_check = BUDGET_CHECK_STEPS
+            if budget is not None and budget.out_of_time():
+                budget.exceeded('time', *span(root))
+        node, ready = stack.pop()
+        if isinstance(node, NumberNode):
+            compiled[id(node)] = (None, node.tok.value)
+            size += 1
+        elif isinstance(node, VarAccessNode):
+            name = node.var_name.value
+            slot = slot_of.get(name)
+            if slot is None:
+                slot = slot_of[name] = len(uses)
+                uses.append(node)
+            compiled[id(node)] = (operator.itemgetter(slot), None)
+            size += 1
+        elif not ready:
+            stack.append((node, True))
+            children = node.element_nodes if isinstance(node, ListNode) else operands(node)
+            stack.extend((child, False) for child in reversed(children))
+        elif isinstance(node, ListNode):
+            compiled[id(node)] = compile_list([compiled.pop(id(child)) for child in node.element_nodes])
+            size += 1
+        else:
+            chain = spine(node)
+            first = compiled.pop(id(chain[0].left_node))
+            steps = [(OPERATIONS[step.op_tok.type], compiled.pop(id(step.right_node)), step) for step in chain]
+            compiled[id(node)] = compile_chain(first, steps, budget)
+            size += len(chain)
+
+    code, value = compiled[id(root)]
+    names = [node.var_name.value for node in uses]
+    return Program(code, value, names, uses, size, *span(root))
+
+def spine(node):
+    """The BinOpNodes down the left of node, innermost (first evaluated) first"""
+    chain = []
+    while isinstance(node, BinOpNode):
+        chain.append(node)
+        node = node.left_node
+    chain.reverse()
+    return chain
+
+def operands(node):
+    """The operands of the operator chain ending at node, in evaluation order"""
+    chain = spine(node)
+    return [chain[0].left_node] + [step.right_node for step in chain]
+
+def compile_list(elements):
+    if all(code is None for code, value in elements):
+        return None, [value for code, value in elements]
+    template = [value for code, value in elements]
+    dynamic = [(i, code) for i, (code, value) in enumerate(elements) if code is not None]
+    def build(slots):
+        values = template.copy()
+        for i, code in dynamic:
+            values[i] = code(slots)
+        return values
+    return build, None
+
+def compile_chain(first, steps, budget=None):
+    code, value = first
+    # Fold the leading steps with constant operands; one that fails is left
+    # to fail when the program runs, where its error is reported. Like the
+    # chain closure, joins extend the list folding built in place
+    folded = 0
+    owned = None
+    while code is None and folded < len(steps) and steps[folded][1][0] is None:
+        op, (_, b), node = steps[folded]
+        if not (folded + 1) % BUDGET_CHECK_STEPS and budget is not None and budget.out_of_time():
+            budget.exceeded('time', *span(node))
+        try:
+            if value is owned and op is add and type(b) is list:
+                check_join(len(value) + len(b))
+                value.extend(b)
+            else:
+                value = op(value, b)
+                if op is add and type(value) is list:
+                    owned = value
+        except OPERATION_ERRORS:
+            break
+        folded += 1
+    steps = steps[folded:]
+    if not steps:
+        return None, value
+    first = code or constant(value)
+
+    if len(steps) == 1:
+        op, (right, b), node = steps[0]
+        return compile_binop(op, first, right, b, node), None
+
+    steps = [(op, right, b, node) for op, (right, b), node in steps]
+    def chain(slots):
+        budget = running.budget
+        left_until_check = BUDGET_CHECK_STEPS
+        owned = None  # a list this run of the chain built, so extended in place
+        a = first(slots)
+        for op, right, b, node in steps:
+            left_until_check -= 1
+            if not left_until_check:
+                left_until_check = BUDGET_CHECK_STEPS
+                if budget is not None and budget.out_of_time():
+                    raise OutOfTime()
+            if right is not None:
+                b = right(slots)
+            try:
+                if a is owned and op is add and type(b) is list:
+                    check_join(len(a) + len(b))
+                    a.extend(b)
+                    continue
+                a = op(a, b)
+            except OPERATION_ERRORS as e:
+                raise operation_error(node, a, b, e)
+            if op is add and type(a) is list:
+                owned = a
+        return a
+    return chain, None
+
+def compile_binop(op, left, right, b, node):
+    if right is None:
+        # Constant right operand, as in x * 2
+        def binop(slots):
+            a = left(slots)
+            try:
+                return op(a, b)
+            except OPERATION_ERRORS as e:
+                raise operation_error(node, a, b, e)
+        return binop
+
+    def binop(slots):
+        a = left(slots)
+        b = right(slots)
+        try:
+            return op(a, b)
+        except OPERATION_ERRORS as e:
+            raise operation_error(node, a, b, e)
+    return binop
+
+def compile_source(fn, text, budget=None):
+    """
+    Lex, parse and compile text: returns (program, error). Lexing, parsing
+    and compiling raise BudgetExceeded if a budget is given and runs out.
+    """
+    tokens, error = FastLexer(fn, text).make_tokens(budget)
+    if error:
+        return None, error
+    ast = IterativeParser(tokens, BINARY_PRECEDENCE, budget).parse()
+    if ast.error:
+        return None, ast.error
+    return compile_ast(ast.node, budget), None
+
+if __name__ == '__main__':
+    program, error = compile_source('<stdin>', sys.argv[1])
+    if not error:
+        variables = {}
+        for arg in sys.argv[2:]:
+            name, _, value = arg.partition('=')
+            variables[name] = json.loads(value)
+        value, error = program.run(variables)
+    if error:
+        print(error.as_string())
+    else:
+        print(json.dumps(value))
@@ -0,0 +1,134 @@
+# Live tokenization channel for the editor
+#
+# A client opens one Server-Sent Events stream per document (GET /live/<doc>)
+# and posts every revision of its buffer to it (POST /live/<doc>). Only the
+# newest revision of a document is kept, so updates that arrive faster than
+# they can be lexed are coalesced: the stream waits until the buffer has
+# been quiet for DEBOUNCE_SECONDS, lexes the newest text, and the lexer
+# checks between slices of the source whether a newer revision has arrived,
+# abandoning the stale one if so. A result is pushed only if it is still
+# for the newest revision when it is ready.
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from basic import Cancelled
+import metrics
+
+DEBOUNCE_SECONDS = 0.05
+# An idle stream sends a comment this often, which also notices closed connections
+KEEPALIVE_SECONDS = 15.0
+MAX_SESSIONS = 256
+
+class LiveSession:
+    """The newest revision posted for one document and the stream that serves it"""
+    def __init__(self, options):
+        self.options = options  # passed on to render
+        self.condition = threading.Condition()
+        self.rev = -1
+        self.code = None
+        self.updated = 0.0
+        self.closed = False
+
+    def update(self, rev, code):
+        """Record a revision; False if it is not newer than the one held"""
+        with self.condition:
+            if self.closed or rev <= self.rev:
+                return False
+            coalesced = self.code is not None
+            self.rev, self.code, self.updated = rev, code, time.monotonic()
+            self.condition.notify_all()
+        metrics.observe_live('received')
+        if coalesced:
+            # The revision it replaces was never lexed
+            metrics.observe_live('coalesced')
+        return True
+
+    def take(self, timeout):
+        """
+        Wait for a revision to be posted and then for DEBOUNCE_SECONDS
+        without another one. Returns (rev, code), or None on timeout or once
+        the session is closed.
+        """
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            while not self.closed:
+                now = time.monotonic()
+                if self.code is not None:
+                    quiet_at = self.updated + DEBOUNCE_SECONDS
+                    if now >= quiet_at:
+                        rev, code = self.rev, self.code
+                        self.code = None
+                        return rev, code
+                    self.condition.wait(quiet_at - now)
+                elif now >= deadline:
+                    return None
+                else:
+                    self.condition.wait(deadline - now)
+            return None
+
+    def is_stale(self, rev):
+        """Whether rev has been superseded, read without the lock (an int compare)"""
+        return self.rev != rev or self.closed
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+class LiveChannel:
+    """The open sessions, one per document, oldest dropped past max_sessions"""
+    def __init__(self, render, max_sessions=MAX_SESSIONS):
+        self.render = render  # render(doc_id, code, cancelled, **options) -> JSON-ready dict
+        self.max_sessions = max_sessions
+        self.sessions = OrderedDict()
+        self.lock = threading.Lock()
+
+    def open(self, doc_id, **options):
+        """A fresh session for doc_id; a stream already open for it is ended"""
+        session = LiveSession(options)
+        with self.lock:
+            old = self.sessions.pop(doc_id, None)
+            self.sessions[doc_id] = session
+            while len(self.sessions) > self.max_sessions:
+                self.sessions.popitem(last=False)[1].close()
+        if old is not None:
+            old.close()
+        return session
+
+    def get(self, doc_id):
+        with self.lock:
+            return self.sessions.get(doc_id)
+
+    def release(self, doc_id, session):
+        with self.lock:
+            if self.sessions.get(doc_id) is session:
+                del self.sessions[doc_id]
+        session.close()
+
+    def events(self, doc_id, session):
+        """The SSE stream of a session: one result event per revision that was not superseded"""
+        try:
+            yield 'retry: 1000\n\n'
+            while not session.closed:
+                taken = session.take(KEEPALIVE_SECONDS)
+                if taken is None:
+                    yield ': keep-alive\n\n'
+                    continue
+                rev, code = taken
+                cancelled = lambda: session.is_stale(rev)
+                try:
+                    data = self.render(doc_id, code, cancelled, **session.options)
+                except Cancelled:
+                    metrics.observe_live('cancelled')
+                    continue
+                if cancelled():
+                    # Superseded after lexing, while parsing or serializing
+                    metrics.observe_live('cancelled')
+                    continue
+                metrics.observe_live('pushed')
+                payload = json.dumps(dict(data, rev=rev), separators=(',', ':'))
+                yield f'event: result\nid: {rev}\ndata: {payload}\n\n'
+        finally:
+            self.release(doc_id, session)
@@ -0,0 +1,215 @@
+# Lex a file on disk without reading it into a str
+#
+# The file is mmapped. When it is pure ASCII, byte offsets are character
+# offsets, so it is lexed straight from the mapping with a bytes build of
+# TOKEN_RE and the TokenStream's text is a MappedText: a read-only str-like
+# view that decodes only the slices a caller asks for (token values, error
+# snippets). Any other file, or one with \r line endings, is decoded as UTF-8
+# with newlines translated like open() does and lexed as a str, which keeps
+# columns counted in characters.
+#
+# Usage: python mapped_lexer.py FILE   (reports tokens, time and peak RSS)
+import mmap
+import re
+import sys
+import time
+
+from basic import (FastLexer, TokenStream, Position, IllegalCharError, BudgetExceeded, TOKEN_RE, OPERATOR_IDS,
+                   G_SKIP, G_COMMENT, G_IDENTIFIER, G_OP, GROUP_TYPE_IDS,
+                   ID_IDENTIFIER, ID_KEYWORD, ID_EOF, KEYWORD_COUNT, MAX_ERRORS, CANCEL_CHECK_CHARS)
+
+# For bytes, \w and \d are ASCII only, which is all an ASCII file can hold
+BYTES_TOKEN_RE = re.compile(TOKEN_RE.pattern.encode('ascii'))
+BYTE_OPERATOR_IDS = {symbol.encode('ascii'): type_id for symbol, type_id in OPERATOR_IDS.items()}
+# Pages of the mapping behind the scan position are dropped from this process
+# every RELEASE_BYTES, so resident memory does not grow with the file; they
+# stay in the page cache for the slices MappedText decodes later
+RELEASE_BYTES = 16 * 1024 * 1024
+
+# Bytes that rule out lexing the mapping as it is
+DECODE_RE = re.compile(rb'[\x80-\xff\r]')
+
+class MappedText:
+    """
+    The text of an ASCII buffer, indexed and sliced like a str. Only what
+    is sliced out is decoded, so a TokenStream, LineIndex or error snippet
+    can use it in place of the whole decoded file.
+    """
+    def __init__(self, data):
+        self.data = data
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return self.data[i].decode('ascii')
+        return chr(self.data[i])
+
+    def find(self, sub, start=0, end=None):
+        if isinstance(sub, str):
+            sub = sub.encode('ascii')
+        return self.data.find(sub, start, len(self.data) if end is None else end)
+
+    def __str__(self):
+        return self.data[:].decode('ascii')
+
+def map_file(path):
+    """A read-only mapping of the file at path (b'' if it is empty)"""
+    with open(path, 'rb') as f:
+        try:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty files cannot be mapped
+            return b''
+
+def scan_bytes(stream, data, idx, stop=None):
+    """FastLexer.scan over an ASCII buffer, up to stop if given: returns (idx, error)"""
+    length = len(data) if stop is None else min(stop, len(data))
+    releasable = isinstance(data, mmap.mmap) and hasattr(data, 'madvise')
+    # At every multiple of RELEASE_BYTES, wherever this scan started
+    release = idx - idx % RELEASE_BYTES + RELEASE_BYTES if releasable else length
+    match = BYTES_TOKEN_RE.match
+    types, starts, ends, symbol_ids = stream.types, stream.starts, stream.ends, stream.symbol_ids
+    symbol_table = stream.symbols
+    symbols = symbol_table.ids
+
+    while idx < length:
+        m = match(data, idx)
+        group = m.lastindex if m else None
+
+        if group == G_SKIP or group == G_COMMENT:
+            idx = m.end()
+            # Checked here rather than per token: whitespace comes often enough
+            if idx >= release:
+                data.madvise(mmap.MADV_DONTNEED, 0, idx - idx % mmap.PAGESIZE)
+                release = idx + RELEASE_BYTES
+            continue
+
+        symbol = -1
+        if group == G_OP:
+            type_id = BYTE_OPERATOR_IDS[m.group()]
+        elif group == G_IDENTIFIER:
+            value = m.group().decode('ascii')
+            symbol = symbols.get(value)
+            if symbol is None:
+                symbol = symbol_table.add(value)
+            type_id = ID_KEYWORD if symbol < KEYWORD_COUNT else ID_IDENTIFIER
+        elif group is not None:
+            type_id = GROUP_TYPE_IDS[group]
+        else:
+            return idx, IllegalCharError(stream.position(idx), stream.position(idx + 1),
+                                         f"'{chr(data[idx])}'")
+
+        end = m.end()
+        types.append(type_id)
+        starts.append(idx)
+        ends.append(end)
+        symbol_ids.append(symbol)
+        idx = end
+
+    return idx, None
+
+def scan_bytes_checked(stream, data, idx, budget):
+    """scan_bytes in slices of CANCEL_CHECK_CHARS, raising BudgetExceeded once the budget runs out"""
+    check_budget = FastLexer(stream.fn, stream.text).check_budget
+    length = len(data)
+    while True:
+        check_budget(stream, idx, budget)
+        idx, error = scan_bytes(stream, data, idx, idx + CANCEL_CHECK_CHARS)
+        if error or idx >= length:
+            check_budget(stream, idx, budget)
+            return idx, error
+
+class FileLexer:
+    """
+    FastLexer.make_tokens_recovering for the file at path, with the same
+    result and self.error_count as on the text open(path).read() would
+    return. An ASCII file with \n line endings is lexed from an mmap and
+    never decoded whole.
+    """
+    def __init__(self, fn, path):
+        self.fn = fn
+        self.path = path
+
+    def make_tokens_recovering(self, max_errors=MAX_ERRORS, budget=None):
+        """
+        Returns (tokens, errors). A budget is held to like FastLexer does,
+        its size limit to the size of the file, checked before anything is
+        read.
+        """
+        fn = self.fn
+        self.error_count = 0
+        data = map_file(self.path)
+        if budget is not None and budget.max_bytes is not None and len(data) > budget.max_bytes:
+            if isinstance(data, mmap.mmap):
+                data.close()
+            pos = Position(0, 0, 0, fn, '')
+            budget.exceeded('bytes', pos, pos)
+        if DECODE_RE.search(data):
+            text = str(data, 'utf-8').replace('\r\n', '\n').replace('\r', '\n')
+            if isinstance(data, mmap.mmap):
+                data.close()
+            lexer = FastLexer(fn, text)
+            tokens, errors = lexer.make_tokens_recovering(max_errors, budget=budget)
+            self.error_count = lexer.error_count
+            return tokens, errors
+
+        text = MappedText(data)
+        stream = TokenStream(fn, text)
+        errors = []
+        if budget is None:
+            scan = lambda idx: scan_bytes(stream, data, idx)
+        else:
+            scan = lambda idx: scan_bytes_checked(stream, data, idx, budget)
+        try:
+            idx, error = scan(0)
+            while error:
+                # Skip the run of illegal characters as one error
+                end = idx + 1
+                while end < len(data) and not BYTES_TOKEN_RE.match(data, end):
+                    end += 1
+                self.error_count += 1
+                if len(errors) < max_errors:
+                    errors.append(IllegalCharError(stream.position(idx), stream.position(end), f"'{text[idx:end]}'"))
+                idx, error = scan(end)
+        except BudgetExceeded as e:
+            # The error's snippet must not read the mapping once it is closed
+            detach(stream, [e.error])
+            raise
+        stream.append(ID_EOF, idx, idx + 1)
+        return stream, errors
+
+def lex_file(fn, path, max_errors=MAX_ERRORS, budget=None):
+    """FileLexer(fn, path).make_tokens_recovering(max_errors, budget): (tokens, errors)"""
+    return FileLexer(fn, path).make_tokens_recovering(max_errors, budget)
+
+def detach(stream, errors=()):
+    """
+    Swap the MappedText of a stream lexed by lex_file (and of its errors'
+    positions) for the decoded text and close the mapping. A stream that is
+    kept past the request must not hold the mapping: reading it after the
+    file was truncated faults the whole process (SIGBUS), and after an
+    in-place rewrite it reads the new contents under the old offsets.
+    Returns the text.
+    """
+    mapped = stream.text
+    if not isinstance(mapped, MappedText):
+        return mapped
+    text = str(mapped)
+    stream.text = text
+    for error in errors:
+        error.pos_start.ftxt = error.pos_end.ftxt = text
+    if isinstance(mapped.data, mmap.mmap):
+        mapped.data.close()
+    return text
+
+if __name__ == '__main__':
+    import resource
+    start = time.perf_counter()
+    tokens, errors = lex_file(sys.argv[1], sys.argv[1])
+    elapsed = time.perf_counter() - start
+    mapped = isinstance(tokens.text, MappedText)
+    print(f'{len(tokens.text) / 1e6:.1f} MB, {len(tokens)} tokens, {len(errors)} error(s), '
+          f'{"mapped" if mapped else "decoded"}, {elapsed:.2f}s')
+    print(f'peak RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MB')
@@ -0,0 +1,124 @@
+import os
+import threading
+from bisect import bisect_left
+
+# Set LEXER_METRICS=0 to turn instrumentation off; every recording helper
+# then returns straight away
+enabled = os.environ.get('LEXER_METRICS', '1') != '0'
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self.values = {}  # label tuple -> value
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        with self.lock:
+            for key, value in sorted(self.values.items()):
+                lines.append(f'{self.name}{format_labels(key)} {value}')
+        return lines
+
+class Histogram:
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self.series = {}  # label tuple -> [bucket counts..., sum, count]
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        i = bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = [0] * (len(self.buckets) + 2)
+            if i < len(self.buckets):
+                series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self.lock:
+            for key, series in sorted(self.series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, series):
+                    cumulative += count
+                    lines.append(f'{self.name}_bucket{format_labels(key + (("le", repr(bound)),))} {cumulative}')
+                lines.append(f'{self.name}_bucket{format_labels(key + (("le", "+Inf"),))} {series[-1]}')
+                lines.append(f'{self.name}_sum{format_labels(key)} {series[-2]}')
+                lines.append(f'{self.name}_count{format_labels(key)} {series[-1]}')
+        return lines
+
+def format_labels(key):
+    if not key:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in key) + '}'
+
+requests_total = Counter('lexer_requests_total', 'Requests handled, by endpoint and status code')
+request_seconds = Histogram('lexer_request_seconds', 'Request latency, by endpoint')
+phase_seconds = Histogram('lexer_phase_seconds', 'Time spent per processing phase')
+tokens_total = Counter('lexer_tokens_total', 'Tokens produced by the lexer')
+chars_total = Counter('lexer_source_chars_total', 'Source characters lexed')
+live_revisions_total = Counter('lexer_live_revisions_total',
+                               'Live channel revisions, by outcome (received, coalesced, cancelled, pushed)')
+budget_exceeded_total = Counter('lexer_budget_exceeded_total',
+                                'Sources refused or stopped by a resource limit, by limit (bytes, tokens, depth, time)')
+
+METRICS = [requests_total, request_seconds, phase_seconds, tokens_total, chars_total, live_revisions_total,
+           budget_exceeded_total]
+
+def observe_request(endpoint, status, seconds):
+    if not enabled:
+        return
+    requests_total.inc(endpoint=endpoint, status=status)
+    request_seconds.observe(seconds, endpoint=endpoint)
+
+def observe_phases(timings):
+    """Record a {phase_ms: milliseconds} dict as filled in by run_recovering"""
+    if not enabled:
+        return
+    for name, ms in timings.items():
+        if name.endswith('_ms'):
+            phase_seconds.observe(ms / 1000, phase=name[:-3])
+
+def observe_lexed(chars, tokens):
+    if not enabled:
+        return
+    chars_total.inc(chars)
+    tokens_total.inc(tokens)
+
+def observe_live(outcome):
+    if not enabled:
+        return
+    live_revisions_total.inc(outcome=outcome)
+
+def observe_budget(limit):
+    if not enabled:
+        return
+    budget_exceeded_total.inc(limit=limit)
+
+def render(extra_lines=()):
+    """All metrics in the Prometheus text exposition format"""
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    lines.extend(extra_lines)
+    return '\n'.join(lines) + '\n'
+
+def gauge_lines(name, help_text, values):
+    """Lines for a gauge computed at scrape time from {label tuple: value}"""
+    lines = [f'# HELP {name} {help_text}', f'# TYPE {name} gauge']
+    for key, value in sorted(values.items()):
+        lines.append(f'{name}{format_labels(key)} {value}')
+    return lines
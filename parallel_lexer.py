@@ -0,0 +1,123 @@
+# Lex one large source on several cores
+#
+# The text is cut at newlines into segments that are lexed independently in
+# worker processes and merged back into a single TokenStream. A newline can
+# only be inside a string lexeme ('#' comments stop at the newline), so one
+# pre-scan over strings and comments is enough to find safe cut points.
+#
+# Usage: python parallel_lexer.py FILE [workers]   (reports the speedup)
+import os
+import re
+import sys
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+
+from basic import FastLexer, TokenStream, IllegalCharError, ID_EOF
+
+# Strings and comments, matched left to right so a '"' inside a comment or a
+# '#' inside a string is not mistaken for the start of the other
+LEXEME_SPAN_RE = re.compile(r'"[^"]*"?|#[^\n\r]*')
+
+MIN_SEGMENT = 1024 * 1024
+
+def split_points(text, segments):
+    """Offsets at which text can be cut into at most `segments` pieces"""
+    length = len(text)
+    spans = LEXEME_SPAN_RE.finditer(text)
+    span = next(spans, None)
+    cuts = [0]
+    searched = 0  # spans before this offset have already been consumed
+
+    for k in range(1, segments):
+        target = max(k * length // segments, searched)
+        cut = text.find('\n', target)
+        while cut >= 0:
+            # Skip spans that end before the candidate newline
+            while span is not None and span.end() <= cut:
+                span = next(spans, None)
+            if span is None or span.start() > cut:
+                break
+            # The newline is inside a string: look again after it
+            cut = text.find('\n', span.end())
+        if cut < 0:
+            break
+        searched = cut + 1
+        if cut + 1 > cuts[-1] and cut + 1 < length:
+            cuts.append(cut + 1)
+
+    cuts.append(length)
+    return cuts
+
+def lex_segment(segment, offset, typecode):
+    """
+    Worker: lex one segment and return its columns rebased to global offsets,
+    with its symbol ids and the names they refer to
+    """
+    stream = TokenStream('<segment>', segment)
+    idx, error = FastLexer('<segment>', segment).scan(stream, 0)
+    starts = array(typecode, (start + offset for start in stream.starts))
+    ends = array(typecode, (end + offset for end in stream.ends))
+    return (stream.types, starts, ends, stream.symbol_ids, stream.symbols.names,
+            (idx + offset if error else None))
+
+def lex_parallel(fn, text, workers=None, executor=None, min_segment=MIN_SEGMENT):
+    """
+    Same result as FastLexer(fn, text).make_tokens(), using up to `workers`
+    processes (default: one per core). Inputs too small to be worth splitting
+    are lexed in-process.
+    """
+    workers = workers or os.cpu_count() or 1
+    segments = min(workers, max(len(text) // min_segment, 1))
+    if segments < 2:
+        return FastLexer(fn, text).make_tokens()
+
+    cuts = split_points(text, segments)
+    own_executor = executor is None
+    if own_executor:
+        executor = ProcessPoolExecutor(max_workers=len(cuts) - 1)
+    try:
+        stream = TokenStream(fn, text)
+        futures = [executor.submit(lex_segment, text[start:end], start, stream.starts.typecode)
+                   for start, end in zip(cuts, cuts[1:])]
+        for future in futures:
+            types, starts, ends, symbol_ids, names, error_idx = future.result()
+            stream.types.extend(types)
+            stream.starts.extend(starts)
+            stream.ends.extend(ends)
+            # Renumber the segment's symbols into the merged table
+            mapping = stream.symbols.merge(names)
+            stream.symbol_ids.extend(array('i', (mapping[symbol] for symbol in symbol_ids)))
+            if error_idx is not None:
+                # Lexing stops at the first illegal character, as it does sequentially
+                return [], IllegalCharError(
+                    stream.position(error_idx), stream.position(error_idx + 1),
+                    f"'{text[error_idx]}'"
+                )
+    finally:
+        if own_executor:
+            executor.shutdown(cancel_futures=True)
+
+    stream.append(ID_EOF, len(text), len(text) + 1)
+    return stream, None
+
+if __name__ == '__main__':
+    with open(sys.argv[1], 'r') as f:
+        text = f.read()
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count() or 1
+
+    start = time.perf_counter()
+    expected, expected_error = FastLexer(sys.argv[1], text).make_tokens()
+    sequential = time.perf_counter() - start
+
+    start = time.perf_counter()
+    tokens, error = lex_parallel(sys.argv[1], text, workers)
+    parallel = time.perf_counter() - start
+
+    same = (type(expected) is type(tokens) and (error is None) == (expected_error is None)
+            and (error is not None or ((expected.types, expected.starts, expected.ends)
+                 == (tokens.types, tokens.starts, tokens.ends)
+                 and expected.occurrences() == tokens.occurrences())))
+    print(f'{len(text) / 1e6:.1f} MB, {len(expected)} tokens, identical output: {same}')
+    print(f'sequential {sequential:.2f}s, {workers} workers {parallel:.2f}s, '
+          f'speedup {sequential / parallel:.2f}x on {os.cpu_count()} core(s)')
@@ -0,0 +1,372 @@
+# Production serving mode
+#
+# An asyncio HTTP/1.1 front end that never lexes on the event loop: /execute
+# is lexed and parsed in a bounded process pool, and every other route is
+# handed to the Flask app (app.py) on a thread. When more than --max-pending
+# jobs are queued or running, new ones are turned away with a 503 straight
+# away instead of waiting behind them; jobs are /execute and the Flask routes
+# that lex or parse (HEAVY_ROUTES). Request bodies larger than
+# --max-body are refused with a 413 before they are read. SIGINT/SIGTERM stop
+# accepting connections, let requests in flight finish (up to --grace
+# seconds) and then shut the pool down.
+#
+# Usage: python server.py [--port 8000] [--workers N] [--max-pending N]
+import argparse
+import asyncio
+import io
+import json
+import os
+import signal
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from http import HTTPStatus
+from urllib.parse import parse_qs, unquote_to_bytes
+
+import app
+import metrics
+from result_cache import ResultCache, source_key
+
+MAX_BODY_BYTES = 8 * 1024 * 1024
+MAX_HEADERS = 100
+JOB_TIMEOUT = 10.0        # seconds an /execute job may take, queueing included
+KEEPALIVE_TIMEOUT = 15.0  # seconds an idle connection is kept open
+SHUTDOWN_GRACE = 10.0     # seconds in-flight requests get to finish on shutdown
+
+# Flask routes that lex, parse or evaluate, and so count against --max-pending
+HEAVY_ROUTES = ('/execute_file', '/execute_delta', '/execute_batch', '/stats', '/evaluate')
+
+class HTTPError(Exception):
+    def __init__(self, status, details):
+        super().__init__(details)
+        self.status = status
+        self.details = details
+
+class Request:
+    def __init__(self, method, target, version, headers, body):
+        self.method = method
+        path, _, self.query = target.partition('?')
+        # Unquoted once, as the app will see it, so routing and the pending
+        # limit cannot be sidestepped with %-escapes (/st%61ts)
+        self.path = unquote_to_bytes(path).decode('latin-1')
+        self.version = version
+        self.headers = headers  # lower-cased name -> value
+        self.body = body
+
+    @property
+    def keep_alive(self):
+        connection = self.headers.get('connection', '').lower()
+        if self.version == 'HTTP/1.0':
+            return connection == 'keep-alive'
+        return connection != 'close'
+
+def render_result(code, fmt, want_tokens, want_timings, page=None):
+    """
+    Worker entry point for /execute: the response body, its mimetype, whether
+    lexing succeeded, the token count, the phase timings and the token stream
+    if asked for (to be remembered for /execute_delta in the front-end process),
+    and the limit the source ran out of (see app.request_budget) or None. With
+    a page size the JSON body holds only the first page of token lists, as
+    app.token_lists sends it.
+    """
+    timings = {}
+    response_data, tokens = app.build_result(code, timings)
+    if tokens is None:
+        data, mimetype = response_data, 'application/json'
+    elif fmt == 'compact':
+        data, mimetype = app.compact_result(response_data, tokens), app.COMPACT_MIMETYPE
+    else:
+        # Streaming buys nothing once the whole result is built off-loop
+        data, mimetype = app.token_lists(response_data, tokens, page, timings), 'application/json'
+    if want_timings:
+        data = dict(data, timings=dict(timings, cache='miss'))
+    body = json.dumps(data, sort_keys=True, separators=(',', ':')).encode('utf-8')
+    success = response_data['success']
+    return (body, mimetype, success, response_data['tokens'], timings,
+            tokens if want_tokens and success else None, response_data.get('budget'))
+
+class LexerServer:
+    def __init__(self, workers=None, max_pending=None, max_body=MAX_BODY_BYTES,
+                 job_timeout=JOB_TIMEOUT, grace=SHUTDOWN_GRACE):
+        self.workers = workers or os.cpu_count() or 1
+        # Enough queued work to keep every worker busy, and no more
+        self.max_pending = max_pending or 4 * self.workers
+        self.max_body = max_body
+        self.job_timeout = job_timeout
+        self.grace = grace
+        self.pool = ProcessPoolExecutor(max_workers=self.workers)
+        self.pending = 0
+        self.cache = ResultCache(max_entries=512, max_bytes=64 * 1024 * 1024)
+        self.connections = {}  # writer -> True while a request is being handled
+        self.closing = False
+        self.loop = None
+
+    async def serve(self, host, port):
+        self.loop = asyncio.get_running_loop()
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        stop = asyncio.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            self.loop.add_signal_handler(signum, stop.set)
+        print(f'Serving on http://{host}:{port} with {self.workers} worker(s), '
+              f'max {self.max_pending} pending jobs')
+
+        await stop.wait()
+        print('Shutting down: finishing requests in flight')
+        self.closing = True
+        server.close()
+        await self.drain()
+        self.pool.shutdown(wait=True, cancel_futures=True)
+
+    async def drain(self):
+        """Close idle connections and wait for busy ones, up to the grace period"""
+        deadline = time.monotonic() + self.grace
+        while self.connections and time.monotonic() < deadline:
+            for writer, busy in list(self.connections.items()):
+                if not busy:
+                    writer.close()
+            await asyncio.sleep(0.05)
+        for writer in list(self.connections):
+            writer.close()
+
+    async def handle_connection(self, reader, writer):
+        self.connections[writer] = False
+        try:
+            while not self.closing:
+                try:
+                    request = await asyncio.wait_for(self.read_request(reader), KEEPALIVE_TIMEOUT)
+                except HTTPError as e:
+                    # The rest of the request was not read, so the connection is unusable
+                    self.write_response(writer, e.status, error_body(e.details), 'application/json', False)
+                    await writer.drain()
+                    break
+                if request is None:
+                    break
+
+                self.connections[writer] = True
+                start = time.perf_counter()
+                status, body, mimetype, extra_headers = await self.dispatch(request, writer)
+                keep_alive = request.keep_alive and not self.closing
+                self.write_response(writer, status, body, mimetype, keep_alive, extra_headers)
+                await writer.drain()
+                self.connections[writer] = False
+                if request.path == '/execute':
+                    metrics.observe_request('execute', status, time.perf_counter() - start)
+                if not keep_alive:
+                    break
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError, ValueError):
+            # Idle, cut off, or a header line over the stream limit
+            pass
+        finally:
+            self.connections.pop(writer, None)
+            writer.close()
+
+    async def read_request(self, reader):
+        """The next request on the connection, or None at end of stream"""
+        line = await reader.readline()
+        if not line.strip():
+            return None
+        try:
+            method, target, version = line.decode('latin-1').split()
+        except ValueError:
+            raise HTTPError(400, 'Malformed request line')
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            if len(headers) >= MAX_HEADERS:
+                raise HTTPError(431, 'Too many headers')
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        if 'chunked' in headers.get('transfer-encoding', '').lower():
+            raise HTTPError(411, 'Chunked request bodies are not supported, send a Content-Length')
+        try:
+            length = int(headers.get('content-length', 0))
+        except ValueError:
+            raise HTTPError(400, 'Invalid Content-Length')
+        if length > self.max_body:
+            raise HTTPError(413, f'Request body too large: {length} bytes, the limit is {self.max_body}')
+        body = await reader.readexactly(length) if length > 0 else b''
+        return Request(method, target, version, headers, body)
+
+    async def dispatch(self, request, writer):
+        """(status, body, mimetype, extra headers) of a request"""
+        if request.path == '/execute' and request.method == 'POST':
+            return await self.execute(request)
+        if request.path.startswith('/live/'):
+            # Responses are sent whole here, so an event stream would never finish;
+            # the editor falls back to /execute when the stream is refused
+            return 404, error_body('The live channel is only served by app.py'), 'application/json', ()
+        peer = writer.get_extra_info('peername') or ('', 0)
+        if not is_heavy(request.path):
+            # Cheap or cached: let the Flask app answer it on a thread
+            return await self.loop.run_in_executor(None, call_wsgi, request, peer[0])
+
+        # Real work on a thread: held to the same limit as /execute jobs
+        if self.pending >= self.max_pending:
+            return busy_response()
+        self.pending += 1
+        future = self.loop.run_in_executor(None, call_wsgi, request, peer[0])
+        future.add_done_callback(lambda _: self.release())
+        return await future
+
+    async def execute(self, request):
+        try:
+            data = json.loads(request.body)
+            code = data.get('code', '')
+            if not isinstance(code, str):
+                raise ValueError
+        except (ValueError, AttributeError):
+            return 400, error_body('Expected a JSON object with a "code" string'), 'application/json', ()
+        if not code.strip():
+            return 200, error_body('Please enter some code to execute'), 'application/json', ()
+
+        fmt = request_format(request)
+        if fmt is None:
+            return 400, error_body('Unknown format, expected one of: json, stream, compact'), 'application/json', ()
+        doc_id = data.get('doc')
+        if not app.valid_doc(doc_id):
+            return 400, error_body('"doc" must be a string'), 'application/json', ()
+        want_timings = bool(data.get('timings') or 'timings' in parse_qs(request.query))
+        page = app.page_size(data.get('page')) if fmt == 'json' else None
+
+        key = (source_key(code), fmt, page)
+        cached = None if want_timings else self.cache.get(key)
+        # A hit from a request without a document has no token stream to remember
+        if cached is not None and not (doc_id and cached[2] and cached[3] is None):
+            body, mimetype, success, tokens = cached
+            if doc_id and success:
+                app.remember_document(doc_id, tokens)
+            return 200, body, mimetype, (('Vary', 'Accept'),)
+
+        if self.pending >= self.max_pending:
+            return busy_response()
+        self.pending += 1
+        try:
+            future = self.pool.submit(render_result, code, fmt, bool(doc_id), want_timings, page)
+        except BrokenProcessPool:
+            self.pending -= 1
+            self.pool = ProcessPoolExecutor(max_workers=self.workers)
+            return 503, error_body('Worker pool restarted, try again'), 'application/json', (('Retry-After', '1'),)
+        # The slot is only freed when the worker is done, even if we gave up waiting
+        future.add_done_callback(lambda _: self.loop.call_soon_threadsafe(self.release))
+
+        try:
+            body, mimetype, success, token_count, timings, tokens, budget = await asyncio.wait_for(
+                asyncio.wrap_future(future), self.job_timeout)
+        except asyncio.TimeoutError:
+            return 504, error_body(f'Time limit of {self.job_timeout:g}s exceeded'), 'application/json', ()
+        except BrokenProcessPool:
+            self.pool = ProcessPoolExecutor(max_workers=self.workers)
+            return 503, error_body('Worker pool restarted, try again'), 'application/json', (('Retry-After', '1'),)
+
+        metrics.observe_phases(timings)
+        metrics.observe_lexed(len(code), token_count)
+        if budget is not None:
+            metrics.observe_budget(budget)
+        if doc_id and success:
+            app.remember_document(doc_id, tokens)
+        if not want_timings and budget != 'time':
+            self.cache.put(key, (body, mimetype, success, tokens), len(body) + 2 * len(code))
+        return 200, body, mimetype, (('Vary', 'Accept'),)
+
+    def release(self):
+        self.pending -= 1
+
+    def write_response(self, writer, status, body, mimetype, keep_alive, extra_headers=()):
+        lines = [f'HTTP/1.1 {status} {HTTPStatus(status).phrase}']
+        for name, value in extra_headers:
+            lines.append(f'{name}: {value}')
+        if mimetype:
+            lines.append(f'Content-Type: {mimetype}')
+        lines.append(f'Content-Length: {len(body)}')
+        lines.append('Connection: ' + ('keep-alive' if keep_alive else 'close'))
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body)
+
+def request_format(request):
+    """Same negotiation as app.response_format, without a Flask request"""
+    names = parse_qs(request.query).get('format')
+    if names:
+        return names[0] if names[0] in app.RESPONSE_FORMATS.values() else None
+    accept = request.headers.get('accept', '')
+    if app.COMPACT_MIMETYPE in accept:
+        return 'compact'
+    return 'stream' if app.STREAM_MIMETYPE in accept else 'json'
+
+def is_heavy(path):
+    # /parse/<doc> parses a whole remembered document
+    return path in HEAVY_ROUTES or path.startswith('/parse/')
+
+def busy_response():
+    return 503, error_body('Server busy, try again shortly'), 'application/json', (('Retry-After', '1'),)
+
+def error_body(details):
+    return json.dumps({'error': details, 'success': False}).encode('utf-8')
+
+def call_wsgi(request, remote_addr):
+    """Run a request through the Flask app, returning it in dispatch's shape"""
+    environ = {
+        'REQUEST_METHOD': request.method,
+        'SCRIPT_NAME': '',
+        'PATH_INFO': request.path,
+        'QUERY_STRING': request.query,
+        'SERVER_NAME': 'localhost',
+        'SERVER_PORT': '0',
+        'SERVER_PROTOCOL': request.version,
+        'REMOTE_ADDR': remote_addr,
+        'CONTENT_LENGTH': str(len(request.body)),
+        'CONTENT_TYPE': request.headers.get('content-type', ''),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': 'http',
+        'wsgi.input': io.BytesIO(request.body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False
+    }
+    for name, value in request.headers.items():
+        if name not in ('content-type', 'content-length'):
+            environ['HTTP_' + name.upper().replace('-', '_')] = value
+
+    response = {}
+    def start_response(status, headers, exc_info=None):
+        response['status'] = int(status.split(' ', 1)[0])
+        response['headers'] = headers
+
+    result = app.app.wsgi_app(environ, start_response)
+    try:
+        body = b''.join(result)
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+
+    mimetype = None
+    extra_headers = []
+    for name, value in response['headers']:
+        lower = name.lower()
+        if lower == 'content-type':
+            mimetype = value
+        elif lower not in ('content-length', 'connection', 'transfer-encoding'):
+            extra_headers.append((name, value))
+    return response['status'], body, mimetype, extra_headers
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve the Lexical Analyzer with a worker pool')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--workers', type=int, help='lexer processes (default: one per CPU)')
+    parser.add_argument('--max-pending', type=int, help='queued + running jobs before 503s (default: 4 per worker)')
+    parser.add_argument('--max-body', type=int, default=MAX_BODY_BYTES, help='largest request body in bytes')
+    parser.add_argument('--job-timeout', type=float, default=JOB_TIMEOUT)
+    parser.add_argument('--grace', type=float, default=SHUTDOWN_GRACE, help='seconds to finish requests on shutdown')
+    args = parser.parse_args(argv)
+
+    server = LexerServer(args.workers, args.max_pending, args.max_body, args.job_timeout, args.grace)
+    asyncio.run(server.serve(args.host, args.port))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
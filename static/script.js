@@ -8,6 +8,33 @@ const outputStats = document.getElementById('outputStats');
 const lineNumbers = document.getElementById('lineNumbers');
 const exampleCards = document.querySelectorAll('.example-card');
 
+// Incremental lexing state: the server keeps the token stream of this
+// document, so later runs only send what changed since the last one
+const docId = 'doc-' + Date.now().toString(36) + '-' + Math.random().toString(36).slice(2);
+let lastRun = null;
+
+// Live channel: a run that has to send the whole buffer posts it as a
+// revision, and results come back over one Server-Sent Events stream. The
+// server only lexes the newest revision, so runs fired in quick succession
+// (example cards, repeated clicks) are coalesced and stale results are never
+// computed or sent. Runs with a result to build on send only their edit to
+// /execute_delta instead.
+let liveSource = null;
+let liveOpen = false;
+let liveRev = 0;
+let liveCode = null;  // buffer posted as revision liveRev
+
+// Results with more tokens than TOKEN_PAGE arrive with only their first page
+// of token lists and are shown as a virtual table: only the rows in view are
+// in the DOM, and pages not loaded yet are fetched from /tokens as they
+// scroll into view
+const TOKEN_PAGE = 2000;
+const ROW_HEIGHT = 24;
+const OVERSCAN_ROWS = 20;
+// Browsers cap element heights; taller tables get a scaled scrollbar
+const MAX_SCROLL_HEIGHT = 8000000;
+let tokenView = null;
+
 // Update line numbers
 function updateLineNumbers() {
     const lines = codeInput.value.split('\n').length;
@@ -22,6 +49,63 @@ codeInput.addEventListener('scroll', () => {
 // Update line numbers on input
 codeInput.addEventListener('input', updateLineNumbers);
 
+function connectLive() {
+    if (!window.EventSource) {
+        return;
+    }
+
+    liveSource = new EventSource(`/live/${docId}?page=${TOKEN_PAGE}`);
+    liveSource.addEventListener('open', () => {
+        liveOpen = true;
+    });
+    liveSource.addEventListener('result', (event) => {
+        const data = JSON.parse(event.data);
+        if (data.rev !== liveRev) {
+            return;  // Answer to a revision posted over since
+        }
+        // The buffer may have been edited since: the server lexed what was posted
+        lastRun = data.success ? runState(liveCode, data) : null;
+        showResponse(data);
+    });
+    liveSource.addEventListener('error', () => {
+        // The browser reconnects by itself unless the stream was refused
+        liveOpen = false;
+    });
+}
+
+// Post the buffer as a new revision; false if the live channel cannot take it
+async function postRevision() {
+    const code = codeInput.value.trim();
+    if (!liveOpen || !code) {
+        return false;
+    }
+
+    const rev = ++liveRev;
+    liveCode = code;
+    // The server's copy of the document changes with this revision, so no
+    // delta is sent until its result has arrived
+    lastRun = null;
+    try {
+        const response = await fetch(`/live/${docId}`, {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+            },
+            body: JSON.stringify({ rev, code }),
+        });
+        if (response.status === 404) {
+            // The server dropped this document's stream: open a new one
+            liveOpen = false;
+            liveSource.close();
+            connectLive();
+            return false;
+        }
+        return response.ok;
+    } catch (error) {
+        return false;
+    }
+}
+
 // Execute code
 async function executeCode() {
     const code = codeInput.value.trim();
@@ -41,20 +125,17 @@ async function executeCode() {
     `;
 
     try {
-        const response = await fetch('/execute', {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json',
-            },
-            body: JSON.stringify({ code }),
-        });
-
-        const data = await response.json();
+        let data = lastRun && await executeDelta(code);
+        // Otherwise, with the live channel open, the result arrives as a stream event
+        if (!data && await postRevision()) {
+            return;
+        }
 
-        if (data.success) {
-            showResult(data.result, data.tokens, data.token_list, data.token_values);
-        } else {
-            showError(data.error, data.tokens, data.token_list, data.token_values);
+        data = data || await executeFull(code);
+        showResponse(data);
+        if (data.success && data.result === undefined) {
+            // A delta run: its tokens are shown, the parse result follows
+            loadParseResult(lastRun);
         }
     } catch (error) {
         showError('Failed to connect to server: ' + error.message);
@@ -70,6 +151,104 @@ async function executeCode() {
     }
 }
 
+// Send the whole buffer and let the server remember its token stream
+async function executeFull(code) {
+    const response = await fetch('/execute', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+        },
+        body: JSON.stringify({ code, doc: docId, page: TOKEN_PAGE }),
+    });
+
+    const data = await response.json();
+    lastRun = data.success ? runState(code, data) : null;
+    return data;
+}
+
+// What a later delta run builds on; the token lists only if all of them were sent
+function runState(code, data) {
+    if (data.paged) {
+        return { code, tokenList: null, tokenValues: null };
+    }
+    return { code, tokenList: data.token_list, tokenValues: data.token_values };
+}
+
+// Send only the edit since the last run; returns null if a full run is needed
+async function executeDelta(code) {
+    // Offsets are counted in UTF-16 units here but in code points on the server
+    if (/[\uD800-\uDFFF]/.test(code) || /[\uD800-\uDFFF]/.test(lastRun.code)) {
+        return null;
+    }
+
+    const delta = computeDelta(lastRun.code, code);
+    const response = await fetch('/execute_delta', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+        },
+        body: JSON.stringify({ doc: docId, ...delta }),
+    });
+
+    const data = await response.json();
+    if (data.resync) {
+        return null;
+    }
+    if (!data.success) {
+        lastRun = null;
+        return data;
+    }
+
+    if (!lastRun.tokenList) {
+        // Paged result: the server has the updated lists, the table fetches them
+        lastRun = { code, tokenList: null, tokenValues: null };
+        return { ...data, token_list: [], token_values: [], total: data.tokens + 1 };
+    }
+
+    const removed = data.old_stop - data.first;
+    const tokenList = spliceArray(lastRun.tokenList, data.first, removed, data.token_list);
+    const tokenValues = spliceArray(lastRun.tokenValues, data.first, removed, data.token_values);
+    lastRun = { code, tokenList, tokenValues };
+    return { ...data, token_list: tokenList, token_values: tokenValues };
+}
+
+// Fetch the parse result of a delta run and add it to the output, unless run has been superseded
+async function loadParseResult(run) {
+    try {
+        const response = await fetch(`/parse/${docId}`);
+        const data = await response.json();
+        const block = outputContent.querySelector('.result-block');
+        if (lastRun === run && data.success && block) {
+            block.insertAdjacentHTML('afterbegin', parseResultHtml(data.result));
+        }
+    } catch (error) {
+        // Only the parse result is missing; the tokens are already shown
+    }
+}
+
+// Common prefix/suffix diff between the last submitted text and the new one
+function computeDelta(oldText, newText) {
+    const minLength = Math.min(oldText.length, newText.length);
+    let start = 0;
+    while (start < minLength && oldText[start] === newText[start]) {
+        start++;
+    }
+
+    let oldEnd = oldText.length;
+    let newEnd = newText.length;
+    while (oldEnd > start && newEnd > start && oldText[oldEnd - 1] === newText[newEnd - 1]) {
+        oldEnd--;
+        newEnd--;
+    }
+
+    return { offset: start, deleted: oldEnd - start, inserted: newText.slice(start, newEnd) };
+}
+
+// Array splice without spreading (large token ranges overflow the call stack)
+function spliceArray(array, start, removeCount, items) {
+    return array.slice(0, start).concat(items, array.slice(start + removeCount));
+}
+
 // Execute test file
 async function executeTestFile() {
     // Disable button and show loading state
@@ -87,22 +266,22 @@ async function executeTestFile() {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
-            }
+            },
+            body: JSON.stringify({ doc: docId, page: TOKEN_PAGE }),
         });
 
         const data = await response.json();
 
+        // The editor now holds the file contents, which the server has not seen as this document
+        lastRun = null;
+
         // Update editor with the executed code
         if (data.executed_code) {
             codeInput.value = data.executed_code;
             updateLineNumbers();
         }
 
-        if (data.success) {
-            showResult(data.result, data.tokens, data.token_list, data.token_values);
-        } else {
-            showError(data.error, data.tokens, data.token_list, data.token_values);
-        }
+        showResponse(data);
     } catch (error) {
         showError('Failed to connect to server: ' + error.message);
     } finally {
@@ -112,96 +291,207 @@ async function executeTestFile() {
     }
 }
 
-// Show result
-// Show result
-function showResult(result, tokens, tokenList = [], tokenValues = []) {
-    let tokenListHtml = '';
-    if (tokenList && tokenList.length > 0) {
-        tokenListHtml = `
-            <div class="result-label">Token Types</div>
-            <div class="result-value" style="font-family: 'Courier New', monospace; word-break: break-all;">
-                ${tokenList.map(token => `<span style="background: rgba(6, 182, 212, 0.1); padding: 2px 6px; margin: 2px; border-radius: 4px; display: inline-block;">${escapeHtml(token)}</span>`).join(' ')}
-            </div>
-        `;
-    }
-
-    let tokenValuesHtml = '';
-    if (tokenValues && tokenValues.length > 0) {
-        tokenValuesHtml = `
-            <div class="result-label">Token Values</div>
-            <div class="result-value" style="font-family: 'Courier New', monospace; word-break: break-all;">
-                ${tokenValues.map(value => `<span style="background: rgba(168, 85, 247, 0.1); padding: 2px 6px; margin: 2px; border-radius: 4px; display: inline-block;">${escapeHtml(value || '—')}</span>`).join(' ')}
-            </div>
-        `;
-    }
-
-    let resultHtml = '';
-    if (result) {
-        resultHtml = `
-            <div class="result-label">Parse Result</div>
-            <div class="result-value">${escapeHtml(result)}</div>
-        `;
+// Show a result or an error response
+function showResponse(data) {
+    if (data.success) {
+        showResult(data.result, data.tokens, data.token_list, data.token_values, data.total);
+    } else {
+        showError(data.error, data.tokens, data.token_list, data.token_values, data.total);
     }
+}
 
+// Show result
+function showResult(result, tokens, tokenList = [], tokenValues = [], total = null) {
     outputContent.innerHTML = `
         <div class="result-block">
-            ${resultHtml}
+            ${parseResultHtml(result)}
             
             <div class="result-label">Token Count</div>
             <div class="result-value">${tokens} token${tokens !== 1 ? 's' : ''}</div>
             
-            ${tokenListHtml}
-            ${tokenValuesHtml}
+            ${tokenListsHtml(tokenList, tokenValues, total)}
         </div>
     `;
+    mountTokenView();
 
     outputStats.innerHTML = `
         <span style="color: var(--success);">✓ Success</span>
     `;
 }
 
+function parseResultHtml(result) {
+    if (!result) {
+        return '';
+    }
+    return `
+        <div class="result-label">Parse Result</div>
+        <div class="result-value">${escapeHtml(result)}</div>
+    `;
+}
+
 // Show error
-function showError(error, tokens = null, tokenList = [], tokenValues = []) {
+function showError(error, tokens = null, tokenList = [], tokenValues = [], total = null) {
     let content = `<div class="error-block">${escapeHtml(error)}</div>`;
 
     if (tokens !== null && tokens !== undefined) {
-        let tokenListHtml = '';
-        if (tokenList && tokenList.length > 0) {
-            tokenListHtml = `
-                <div class="result-label">Token Types</div>
-                <div class="result-value" style="font-family: 'Courier New', monospace; word-break: break-all;">
-                    ${tokenList.map(token => `<span style="background: rgba(6, 182, 212, 0.1); padding: 2px 6px; margin: 2px; border-radius: 4px; display: inline-block;">${escapeHtml(token)}</span>`).join(' ')}
-                </div>
-            `;
-        }
-
-        let tokenValuesHtml = '';
-        if (tokenValues && tokenValues.length > 0) {
-            tokenValuesHtml = `
-                <div class="result-label">Token Values</div>
-                <div class="result-value" style="font-family: 'Courier New', monospace; word-break: break-all;">
-                    ${tokenValues.map(value => `<span style="background: rgba(168, 85, 247, 0.1); padding: 2px 6px; margin: 2px; border-radius: 4px; display: inline-block;">${escapeHtml(value || '—')}</span>`).join(' ')}
-                </div>
-            `;
-        }
-
         content += `
             <div style="margin-top: 1rem;">
                 <div class="result-label">Token Count</div>
                 <div class="result-value">${tokens} token${tokens !== 1 ? 's' : ''}</div>
-                ${tokenListHtml}
-                ${tokenValuesHtml}
+                ${tokenListsHtml(tokenList, tokenValues, total)}
             </div>
         `;
+    } else {
+        tokenView = null;
     }
 
     outputContent.innerHTML = content;
+    mountTokenView();
 
     outputStats.innerHTML = `
         <span style="color: var(--error);">✗ Error</span>
     `;
 }
 
+// Token type and value chips, or the frame of a virtual table for long or paged lists
+function tokenListsHtml(tokenList = [], tokenValues = [], total = null) {
+    tokenList = tokenList || [];
+    tokenValues = tokenValues || [];
+    total = total ?? tokenList.length;
+    if (total > TOKEN_PAGE || tokenList.length < total) {
+        tokenView = createTokenView(tokenList, tokenValues, total);
+        return `
+            <div class="result-label">Tokens</div>
+            <div class="token-viewport">
+                <div class="token-spacer"><div class="token-rows"></div></div>
+            </div>
+        `;
+    }
+    tokenView = null;
+
+    let tokenListHtml = '';
+    if (tokenList.length > 0) {
+        tokenListHtml = `
+            <div class="result-label">Token Types</div>
+            <div class="result-value" style="font-family: 'Courier New', monospace; word-break: break-all;">
+                ${tokenList.map(token => `<span style="background: rgba(6, 182, 212, 0.1); padding: 2px 6px; margin: 2px; border-radius: 4px; display: inline-block;">${escapeHtml(token)}</span>`).join(' ')}
+            </div>
+        `;
+    }
+
+    let tokenValuesHtml = '';
+    if (tokenValues.length > 0) {
+        tokenValuesHtml = `
+            <div class="result-label">Token Values</div>
+            <div class="result-value" style="font-family: 'Courier New', monospace; word-break: break-all;">
+                ${tokenValues.map(value => `<span style="background: rgba(168, 85, 247, 0.1); padding: 2px 6px; margin: 2px; border-radius: 4px; display: inline-block;">${escapeHtml(value || '—')}</span>`).join(' ')}
+            </div>
+        `;
+    }
+
+    return tokenListHtml + tokenValuesHtml;
+}
+
+// Token lists of a result, held a page at a time
+function createTokenView(tokenList, tokenValues, total) {
+    const view = { total, pages: new Map(), loading: new Set() };
+    for (let start = 0; start < tokenList.length; start += TOKEN_PAGE) {
+        const end = start + TOKEN_PAGE;
+        // A short last page is only complete if it ends the list
+        if (end <= tokenList.length || tokenList.length >= total) {
+            view.pages.set(start / TOKEN_PAGE, {
+                types: tokenList.slice(start, end),
+                values: tokenValues.slice(start, end),
+            });
+        }
+    }
+    return view;
+}
+
+// Render the rows of tokenView in view, and again on scroll or when a page arrives
+function mountTokenView() {
+    const view = tokenView;
+    const viewport = view && outputContent.querySelector('.token-viewport');
+    if (!viewport) {
+        return;
+    }
+
+    const spacer = viewport.querySelector('.token-spacer');
+    const rows = viewport.querySelector('.token-rows');
+    const fullHeight = view.total * ROW_HEIGHT;
+    const height = Math.min(fullHeight, MAX_SCROLL_HEIGHT);
+    spacer.style.height = height + 'px';
+
+    let scheduled = false;
+    const schedule = () => {
+        if (!scheduled) {
+            scheduled = true;
+            requestAnimationFrame(render);
+        }
+    };
+
+    function render() {
+        scheduled = false;
+        if (tokenView !== view) {
+            return;
+        }
+
+        const scrollTop = viewport.scrollTop;
+        const visible = Math.ceil(viewport.clientHeight / ROW_HEIGHT);
+        let anchor;
+        let offset;
+        if (height === fullHeight) {
+            anchor = Math.floor(scrollTop / ROW_HEIGHT);
+            offset = anchor * ROW_HEIGHT;
+        } else {
+            // Scaled: the scroll range maps onto the rows, and the rows stay at the scroll position
+            const range = Math.max(1, height - viewport.clientHeight);
+            anchor = Math.floor(scrollTop / range * Math.max(0, view.total - visible));
+            offset = scrollTop;
+        }
+        const first = Math.max(0, anchor - OVERSCAN_ROWS);
+        const last = Math.min(view.total, anchor + visible + OVERSCAN_ROWS);
+
+        let html = '';
+        for (let i = first; i < last; i++) {
+            const page = view.pages.get(Math.floor(i / TOKEN_PAGE));
+            const k = i % TOKEN_PAGE;
+            html += page
+                ? `<div class="token-row"><span class="token-index">${i}</span><span class="token-type">${escapeHtml(page.types[k])}</span><span class="token-value">${escapeHtml(page.values[k] || '—')}</span></div>`
+                : `<div class="token-row token-row-loading"><span class="token-index">${i}</span><span class="token-type">…</span></div>`;
+        }
+        rows.style.transform = `translateY(${offset - (anchor - first) * ROW_HEIGHT}px)`;
+        rows.innerHTML = html;
+
+        loadPages(view, first, last, schedule);
+    }
+
+    viewport.addEventListener('scroll', schedule);
+    render();
+}
+
+// Fetch the pages of rows first..last that are neither loaded nor on their way
+function loadPages(view, first, last, onLoad) {
+    for (let p = Math.floor(first / TOKEN_PAGE); p * TOKEN_PAGE < last; p++) {
+        if (view.pages.has(p) || view.loading.has(p)) {
+            continue;
+        }
+
+        view.loading.add(p);
+        fetch(`/tokens/${docId}?start=${p * TOKEN_PAGE}&count=${TOKEN_PAGE}`)
+            .then(response => response.json())
+            .then(data => {
+                // Dropped if the document has been run again since
+                if (tokenView === view && data.success && data.total === view.total) {
+                    view.pages.set(p, { types: data.token_list, values: data.token_values });
+                    onLoad();
+                }
+            })
+            .catch(() => {})
+            .finally(() => view.loading.delete(p));
+    }
+}
+
 // Escape HTML to prevent XSS
 function escapeHtml(text) {
     const div = document.createElement('div');
@@ -212,6 +502,7 @@ function escapeHtml(text) {
 // Clear editor
 function clearEditor() {
     codeInput.value = '';
+    tokenView = null;
     updateLineNumbers();
     outputContent.innerHTML = `
         <div class="empty-state">
@@ -289,4 +580,5 @@ document.head.appendChild(style);
 
 // Initialize
 updateLineNumbers();
+connectLive();
 codeInput.focus();
@@ -1,14 +1,43 @@
+from array import array
+from bisect import bisect_left, bisect_right
+from functools import lru_cache
+
+class LineIndex:
+    """
+    Offsets of the start of every line in a source text, so the line holding
+    an offset (or the next newline after it) is a bisect away instead of a
+    scan over the text
+    """
+    def __init__(self, text):
+        self.text = text
+        starts = array('q', [0])
+        newline = '\n' if isinstance(text, str) else b'\n'
+        idx = text.find(newline)
+        while idx >= 0:
+            starts.append(idx + 1)
+            idx = text.find(newline, idx + 1)
+        self.starts = starts
+
+@lru_cache(maxsize=4)
+def line_index(text):
+    """The shared LineIndex of text, built on first use"""
+    return LineIndex(text)
+
 def string_with_arrows(text, pos_start, pos_end):
     """
     Generate a string with arrows pointing to the error location
     """
-    result = ''
+    index = line_index(text)
+    starts = index.starts
+    last = len(starts)
+    parts = []
+
+    # Calculate indices: k is the line whose starting newline ends the snippet line
+    line = bisect_right(starts, pos_start.idx) - 1
+    idx_start = starts[line] - 1 if line > 0 else 0
+    k = bisect_left(starts, idx_start + 2)
+    idx_end = starts[k] - 1 if k < last else len(text)
 
-    # Calculate indices
-    idx_start = max(text.rfind('\n', 0, pos_start.idx), 0)
-    idx_end = text.find('\n', idx_start + 1)
-    if idx_end < 0: idx_end = len(text)
-    
     # Generate each line
     line_count = pos_end.ln - pos_start.ln + 1
     for i in range(line_count):
@@ -18,12 +47,13 @@ def string_with_arrows(text, pos_start, pos_end):
         col_end = pos_end.col if i == line_count - 1 else len(line) - 1
 
         # Append to result
-        result += line + '\n'
-        result += ' ' * col_start + '^' * (col_end - col_start)
+        parts.append(line)
+        parts.append('\n')
+        parts.append(' ' * col_start + '^' * (col_end - col_start))
 
         # Re-calculate indices
         idx_start = idx_end
-        idx_end = text.find('\n', idx_start + 1)
-        if idx_end < 0: idx_end = len(text)
+        k += 1
+        idx_end = starts[k] - 1 if k < last else len(text)
 
-    return result.replace('\t', '')
+    return ''.join(parts).replace('\t', '')
@@ -0,0 +1,87 @@
+# Compile a declarative token specification into lexer tables
+#
+# The spec (basic.TOKEN_SPEC) lists every token type with either a literal
+# symbol or a regular expression. From it this module generates:
+#   - the master pattern FastLexer matches with, one named group per
+#     ignored lexeme and per pattern row, then one group for all symbols
+#   - a DFA over characters recognising the symbols by longest match, as a
+#     transition table, which the reference Lexer walks
+#   - the symbol <-> type maps used by the lexers and the web serializer
+#
+# The table is compiled at import: that takes well under a tenth of a
+# millisecond, less than reading it back from a disk cache did. The costly
+# step at startup is re.compile of the master pattern (about half a
+# millisecond), and a compiled pattern cannot be cached across processes.
+import re
+
+def compile_spec(spec, ignored):
+    """
+    Build the table for spec, a sequence of (type, symbol, pattern) rows,
+    and ignored, a sequence of (name, pattern) rows for lexemes that produce
+    no token. Rows with neither a symbol nor a pattern are never matched.
+    """
+    groups = [None]  # group number -> name; 0 is the whole match
+    alternatives = []
+    for name, pattern in ignored:
+        groups.append(name)
+        alternatives.append(f'(?P<{name}>{pattern})')
+    for type_, symbol, pattern in spec:
+        if pattern is not None:
+            groups.append(type_)
+            alternatives.append(f'(?P<{type_}>{pattern})')
+
+    symbols = {symbol: type_ for type_, symbol, pattern in spec if symbol}
+    # Longer symbols first, so == is tried before =, and the single
+    # characters as one class, which re matches with a single test
+    longer = sorted((symbol for symbol in symbols if len(symbol) > 1), key=lambda symbol: (-len(symbol), symbol))
+    chars = sorted(symbol for symbol in symbols if len(symbol) == 1)
+    options = [re.escape(symbol) for symbol in longer]
+    if chars:
+        options.append('[' + ''.join('\\' + char if char in '\\]^-' else char for char in chars) + ']')
+    groups.append('OP')
+    alternatives.append('(?P<OP>' + '|'.join(options) + ')')
+
+    transitions, accepts = build_dfa(symbols)
+    return {
+        'pattern': '|'.join(alternatives),
+        'groups': groups,
+        'symbols': {type_: symbol for symbol, type_ in symbols.items()},
+        'transitions': transitions,
+        'accepts': accepts
+    }
+
+def build_dfa(symbols):
+    """
+    Transition table of the DFA accepting exactly the given symbols: state 0
+    is the start, transitions[state] maps a character to the next state and
+    accepts[state] is the type recognised there (None if not accepting).
+    For a finite set of strings the trie of the symbols is such a DFA.
+    """
+    transitions = [{}]
+    accepts = [None]
+    for symbol, type_ in sorted(symbols.items()):
+        state = 0
+        for char in symbol:
+            following = transitions[state].get(char)
+            if following is None:
+                following = transitions[state][char] = len(transitions)
+                transitions.append({})
+                accepts.append(None)
+            state = following
+        accepts[state] = type_
+    return transitions, accepts
+
+def longest_match(table, text, idx):
+    """(type, end) of the longest symbol starting at text[idx], or (None, idx)"""
+    transitions, accepts = table['transitions'], table['accepts']
+    state = 0
+    type_, end = None, idx
+    length = len(text)
+    while idx < length:
+        state = transitions[state].get(text[idx])
+        if state is None:
+            break
+        idx += 1
+        if accepts[state] is not None:
+            type_, end = accepts[state], idx
+    return type_, end
@@ -0,0 +1,44 @@
+# Token list serializations shared by the web app and the corpus CLI: the
+# parallel type / value lists the UI shows, and the columnar compact form.
+# Both read a TokenStream's columns directly, so no Token objects are built.
+from basic import TOKEN_TYPES, TOKEN_SYMBOLS
+
+def serialize_tokens(tokens, start=0, stop=None):
+    """Build the parallel token type / token value lists shown in the UI"""
+    token_list = []
+    token_values = []
+    
+    # Read the columns directly so no Token objects are built
+    for i in range(start, len(tokens) if stop is None else stop):
+        token_type = tokens.type_of(i)
+        token_list.append(token_type)
+        
+        # Token value (actual text representation)
+        value = tokens.value_of(i)
+        if value is not None:
+            # Has a value (like numbers, identifiers, keywords)
+            token_values.append(str(value))
+        else:
+            # Operators are spelled as in TOKEN_SPEC; EOF has no text
+            token_values.append(TOKEN_SYMBOLS.get(token_type, ''))
+    
+    return token_list, token_values
+
+def compact_result(response_data, tokens):
+    """
+    Columnar form of a result: one table of type names, then per token a
+    type id, the gap since the previous token's end and its length, so
+    token i spans executed_code[start:start + lengths[i]] with
+    start = previous end + gaps[i]
+    """
+    data = {key: value for key, value in response_data.items()
+            if key != 'token_list' and key != 'token_values'}
+    starts, ends = tokens.starts, tokens.ends
+    gaps = [starts[0]] if starts else []
+    gaps.extend(map(int.__sub__, starts[1:], ends))
+    data['format'] = 'compact'
+    data['types'] = TOKEN_TYPES
+    data['type_ids'] = tokens.types.tolist()
+    data['gaps'] = gaps
+    data['lengths'] = list(map(int.__sub__, ends, starts))
+    return data
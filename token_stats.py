@@ -0,0 +1,127 @@
+# Token statistics for dashboards: token type histogram, token length
+# distribution and identifier / keyword frequency
+#
+# Everything is counted from a TokenStream's columns, so no Token objects
+# are built. With numpy installed the columns are viewed as arrays without
+# copying and counted with bincount and unique; without it the same counts
+# come from collections.Counter, which also iterates the arrays in C. One
+# TokenStats can take the streams of many files; symbol ids are per stream,
+# so names are merged by spelling.
+#
+# Usage: python token_stats.py [--top N] FILE ...   (prints the aggregate as JSON)
+import json
+import sys
+from collections import Counter
+from itertools import islice
+from operator import sub
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from basic import TOKEN_TYPES, KEYWORDS, ID_EOF
+
+TOP_IDENTIFIERS = 20
+LENGTH_PERCENTILES = (50, 90, 99)
+
+class TokenStats:
+    def __init__(self):
+        self.files = 0
+        self.tokens = 0
+        self.errors = 0
+        self.type_counts = [0] * len(TOKEN_TYPES)
+        self.length_counts = Counter()  # token length -> tokens
+        self.name_counts = Counter()    # identifier or keyword -> occurrences
+
+    def add(self, stream, errors=0):
+        """Count the tokens of stream, not including its EOF token"""
+        n = len(stream.types)
+        if n and stream.types[-1] == ID_EOF:
+            n -= 1
+        self.files += 1
+        self.tokens += n
+        self.errors += errors
+        if numpy is not None:
+            self._add_columns(stream, n)
+        else:
+            self._add_counted(stream, n)
+
+    def _add_columns(self, stream, n):
+        # array typecodes double as numpy dtype codes for these columns
+        types = numpy.frombuffer(stream.types, dtype=stream.types.typecode, count=n)
+        for type_id, count in enumerate(numpy.bincount(types, minlength=len(TOKEN_TYPES)).tolist()):
+            self.type_counts[type_id] += count
+
+        starts = numpy.frombuffer(stream.starts, dtype=stream.starts.typecode, count=n)
+        ends = numpy.frombuffer(stream.ends, dtype=stream.ends.typecode, count=n)
+        lengths, counts = numpy.unique(ends - starts, return_counts=True)
+        self.length_counts.update(dict(zip(lengths.tolist(), counts.tolist())))
+
+        symbol_ids = numpy.frombuffer(stream.symbol_ids, dtype=stream.symbol_ids.typecode, count=n)
+        symbol_counts = numpy.bincount(symbol_ids[symbol_ids >= 0], minlength=len(stream.symbols))
+        names = stream.symbols.names
+        for symbol in numpy.flatnonzero(symbol_counts).tolist():
+            self.name_counts[names[symbol]] += int(symbol_counts[symbol])
+
+    def _add_counted(self, stream, n):
+        for type_id, count in Counter(islice(stream.types, n)).items():
+            self.type_counts[type_id] += count
+        self.length_counts.update(islice(map(sub, stream.ends, stream.starts), n))
+        self.name_counts.update(stream.occurrences())
+
+    def as_dict(self, top=TOP_IDENTIFIERS):
+        keywords = {name: self.name_counts[name] for name in KEYWORDS if self.name_counts[name]}
+        identifiers = Counter({name: count for name, count in self.name_counts.items() if name not in keywords})
+        return {
+            'files': self.files,
+            'tokens': self.tokens,
+            'errors': self.errors,
+            'types': {type_: count for type_, count in zip(TOKEN_TYPES, self.type_counts) if count},
+            'lengths': self.length_summary(),
+            'identifiers': {
+                'distinct': len(identifiers),
+                'total': sum(identifiers.values()),
+                'top': identifiers.most_common(top)
+            },
+            'keywords': keywords
+        }
+
+    def length_summary(self):
+        """Mean, max, percentiles and the full histogram of token lengths"""
+        histogram = sorted(self.length_counts.items())
+        total = sum(count for length, count in histogram)
+        summary = {
+            'mean': sum(length * count for length, count in histogram) / total if total else 0,
+            'max': histogram[-1][0] if histogram else 0,
+        }
+        # Walk the sorted histogram once, filling each percentile as it is passed
+        wanted = [(p, p * total / 100) for p in LENGTH_PERCENTILES]
+        seen = 0
+        for length, count in histogram:
+            seen += count
+            while wanted and seen >= wanted[0][1]:
+                summary[f'p{wanted.pop(0)[0]}'] = length
+        for p, rank in wanted:
+            summary[f'p{p}'] = 0
+        summary['histogram'] = histogram
+        return summary
+
+def token_stats(stream, errors=0, top=TOP_IDENTIFIERS):
+    """Statistics of a single stream, as a JSON-ready dict"""
+    stats = TokenStats()
+    stats.add(stream, errors)
+    return stats.as_dict(top)
+
+if __name__ == '__main__':
+    from mapped_lexer import FileLexer
+    args = sys.argv[1:]
+    top = TOP_IDENTIFIERS
+    if args[:1] == ['--top']:
+        top, args = int(args[1]), args[2:]
+    stats = TokenStats()
+    for path in args:
+        lexer = FileLexer(path, path)
+        tokens, errors = lexer.make_tokens_recovering()
+        stats.add(tokens, lexer.error_count)
+    print(json.dumps(stats.as_dict(top), indent=2))